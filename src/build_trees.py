@@ -0,0 +1,195 @@
+"""
+Build shot trees from many raw data files at once
+
+Each raw file is parsed by its own worker process and the resulting tree is
+cached in the tree directory (default: data/trees/).
+The cached trees are merged into a combined tree which is cached as well,
+so asking for the same selection of files again only has to read one file.
+
+Files from the Match Charting Project are named like charting-m-points-2010s.csv,
+which lets them be selected by tour (m/w) and decade (to-2009, 2010s, 2020s, ...)
+without reading them.
+
+"""
+import os
+import re
+import sys
+import glob
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from tree import sort_data, save_tree, load_tree, read_tree_metadata, merge_trees
+from parse_raw_data import get_point_data
+
+TREE_DIRECTORY = "data/trees/"
+RAW_FILE_PATTERN = re.compile(r"charting-([mw])-points-(.+)\.csv$")
+
+def usage(return_val):
+    print("""
+Tree Builder:
+    USAGE: python3 build_trees.py [FLAGS] [OPTIONS]
+    -tree PATH          : raw data file, directory or glob (directories use every *points*.csv in them)
+    -tour TOURS         : comma separated list of tours to use (m, w)
+    -decade DECADES     : comma separated list of decades to use (to-2009, 2010s, 2020s, ...)
+    -cache DIRECTORY    : directory the built trees are stored in
+    -e ENCODING         : encoding of the raw files
+    -h                  : print out this message
+
+    DEFAULTS:
+    PATH                = data/raw/
+    DIRECTORY           = data/trees/
+    ENCODING            = windows-1252
+    """)
+    sys.exit(return_val)
+
+def is_multi_file(path: str) -> bool:
+    """
+        True if the path names more than a single file (a directory or a glob)
+    """
+    return os.path.isdir(path) or glob.has_magic(path)
+
+def find_raw_files(path: str) -> list:
+    """
+        List the raw files described by a directory or glob
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, "*points*.csv")
+    return sorted(glob.glob(path))
+
+def describe_raw_file(path: str) -> tuple:
+    """
+        Returns (tour, decade) of a Match Charting Project file
+        (None, None) if the file name does not follow their naming scheme
+    """
+    match = RAW_FILE_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+def select_raw_files(files: list, tours: list=[], decades: list=[]) -> list:
+    """
+        Filter the files by tour and decade, an empty filter allows everything
+    """
+    selected = []
+    for path in files:
+        tour, decade = describe_raw_file(path)
+        if tours and tour not in tours:
+            continue
+        if decades and decade not in decades:
+            continue
+        selected.append(path)
+    return selected
+
+def source_stamp(path: str) -> str:
+    """
+        String that changes whenever the raw file changes
+    """
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def selection_key(files: list) -> str:
+    """
+        Short hash of the selected files, so different selections get different combined trees
+    """
+    return hashlib.sha1("\n".join(os.path.abspath(f) for f in files).encode("utf8")).hexdigest()[:8]
+
+def build_settings(encoding: str, max_nodes, max_depth) -> str:
+    return f"encoding={encoding} max_nodes={max_nodes} max_depth={max_depth}"
+
+def cache_is_valid(cache_path: str, sources: str, settings: str) -> bool:
+    """
+        The cache can be used if it was built from the same files with the same settings
+    """
+    if not os.path.exists(cache_path):
+        return False
+    metadata = read_tree_metadata(cache_path)
+    return metadata.get("sources") == sources and metadata.get("settings") == settings
+
+def build_file_tree(raw_path: str, cache_path: str, encoding: str="windows-1252", max_nodes=None, max_depth=None) -> str:
+    """
+        Build the tree for a single raw file and write it to cache_path
+        Nothing is done if the cached tree is still up to date
+
+        Runs inside a worker process, returns the path of the cached tree
+    """
+    sources = source_stamp(raw_path)
+    settings = build_settings(encoding, max_nodes, max_depth)
+    if not cache_is_valid(cache_path, sources, settings):
+        tree = sort_data(
+            get_point_data(raw_path, encoding=encoding),
+            max_nodes=max_nodes,
+            max_depth=max_depth)
+        save_tree(tree, cache_path, {"sources": sources, "settings": settings})
+    return cache_path
+
+def build_trees(path: str, tours: list=[], decades: list=[], cache_dir: str=TREE_DIRECTORY, encoding: str="windows-1252", max_nodes=None, max_depth=None, verbose=False):
+    """
+        Build (or load from the cache) the combined tree of every raw file
+        selected by path, tours and decades
+    """
+    files = select_raw_files(find_raw_files(path), tours, decades)
+    if not files:
+        print("no raw files found for", path)
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    settings = build_settings(encoding, max_nodes, max_depth)
+    sources = ";".join(source_stamp(f) for f in files)
+    combined_path = os.path.join(
+        cache_dir,
+        f"combined-{'+'.join(tours) or 'all'}-{'+'.join(decades) or 'all'}-{selection_key(files)}.tree")
+    if cache_is_valid(combined_path, sources, settings):
+        if verbose:
+            print("using cached tree", combined_path)
+        return load_tree(combined_path)
+
+    cache_paths = [os.path.join(cache_dir, os.path.basename(f) + ".tree") for f in files]
+    # one worker per file
+    with ProcessPoolExecutor(max_workers=len(files)) as executor:
+        jobs = [
+            executor.submit(build_file_tree, raw_path, cache_path, encoding, max_nodes, max_depth)
+            for raw_path, cache_path in zip(files, cache_paths)
+        ]
+        for raw_path, job in zip(files, jobs):
+            job.result()
+            if verbose:
+                print("built", raw_path)
+    if len(cache_paths) == 1:
+        return load_tree(cache_paths[0])
+    tree = merge_trees([load_tree(cache_path) for cache_path in cache_paths])
+    save_tree(tree, combined_path, {"sources": sources, "settings": settings})
+    return tree
+
+def main():
+    """
+        Build the trees without playing any games
+    """
+    path = "data/raw/"
+    tours = []
+    decades = []
+    cache_dir = TREE_DIRECTORY
+    encoding = "windows-1252"
+    arguments = sys.argv[1:]
+    try:
+        while arguments:
+            current_arg = arguments.pop(0)
+            if current_arg == '-h':
+                usage(0)
+            elif current_arg == '-tree':
+                path = arguments.pop(0)
+            elif current_arg == '-tour':
+                tours = arguments.pop(0).split(",")
+            elif current_arg == '-decade':
+                decades = arguments.pop(0).split(",")
+            elif current_arg == '-cache':
+                cache_dir = arguments.pop(0)
+            elif current_arg == '-e':
+                encoding = arguments.pop(0)
+            else:
+                usage(1)
+    except Exception:
+        usage(1)
+    tree = build_trees(path, tours, decades, cache_dir, encoding, verbose=True)
+    if tree is not None:
+        print("number of nodes:", tree.count_nodes())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+Confidence intervals shared by the tournament and the sampled tree build
+
+"""
+import math
+
+Z_95 = 1.959964 # z value of a 95% confidence interval
+
+def wilson_interval(successes: int, trials: int, z: float=Z_95) -> tuple:
+    """
+        Wilson score confidence interval of a proportion
+        returns (low, high), (0, 1) if there were no trials
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    proportion = successes / trials
+    denominator = 1 + z * z / trials
+    center = (proportion + z * z / (2 * trials)) / denominator
+    spread = z * math.sqrt(proportion * (1 - proportion) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - spread), min(1.0, center + spread)
@@ -0,0 +1,145 @@
+"""
+Variable-order context model built from the shot tree
+
+For every sequence of the last 1..k shots of a rally the index stores what
+was hit next, no matter what happened earlier in the rally.
+When a node in the tree has too little data the algorithms can back off to
+the longest context that has enough support instead of searching the whole
+tree for another node of the same shot.
+
+The nodes handed out by the index are regular Shot objects:
+    lookup(shot).next_shots     = shots hit after that context
+    each of those next shots    = counts and probabilities for that shot after the context,
+                                  its next_shots are the ones of the (one shot longer) context
+
+The contexts should be counted before clean_tree, the shots it removes are the
+rare ones the contexts are meant to pool. The nodes of the tree the algorithms
+play on are registered afterwards with use_tree.
+
+"""
+from tree import Shot
+from overlay import OverlayShot
+
+MAX_CONTEXT = 3 # number of previous shots used as context
+MIN_SUPPORT = 10 # a context is only used if it has been seen at least this many times
+
+class ContextIndex:
+    """
+        Tables keyed by the last 1..max_context shots of a rally
+        Contains:
+            contexts: dict[tuple, Shot]  = aggregated node for each context
+            paths   : dict[int, tuple]   = context of every node the index knows about (keyed by id)
+
+        trees is the tree (or list of trees, e.g. the layers of an overlay) the contexts are counted from,
+        search_tree the tree the algorithms play on (see use_tree)
+    """
+    def __init__(self, trees, max_context: int=MAX_CONTEXT, min_support: int=MIN_SUPPORT, search_tree: Shot=None):
+        self.max_context = max_context
+        self.min_support = min_support
+        self.contexts = {}
+        self.paths = {}
+        self.build([trees] if isinstance(trees, Shot) else trees)
+        if search_tree is not None:
+            self.use_tree(search_tree)
+
+    def build(self, trees: list):
+        """
+            Walk the trees once and aggregate the next shots of every context
+        """
+        counts = {} # context -> next shot -> [num_hit, outcomes]
+        stack = [(shot, (shot.shot,)) for tree in trees for shot in tree.next_shots]
+        while stack:
+            node, path = stack.pop()
+            for next_shot in node.next_shots:
+                for length in range(1, min(self.max_context, len(path)) + 1):
+                    table = counts.setdefault(path[-length:], {})
+                    try:
+                        entry = table[next_shot.shot]
+                    except KeyError:
+                        entry = table[next_shot.shot] = [0, {}]
+                    entry[0] += next_shot.num_hit
+                    for outcome in next_shot.outcomes:
+                        try:
+                            entry[1][outcome] += next_shot.outcomes[outcome]
+                        except KeyError:
+                            entry[1][outcome] = next_shot.outcomes[outcome]
+                stack.append((next_shot, path + (next_shot.shot,)))
+
+        for context in counts:
+            context_node = Shot(context[-1], 0, 0, [], {})
+            for shot in counts[context]:
+                num_hit, outcomes = counts[context][shot]
+                next_shot = Shot(shot, num_hit, 0, [], outcomes)
+                next_shot.update_probabilities()
+                context_node.next_shots.append(next_shot)
+                context_node.num_hit += num_hit
+            context_node.next_shots.sort(key=lambda x: x.num_hit, reverse=True)
+            self.contexts[context] = context_node
+
+        # link every aggregated next shot to the context it leads to
+        for context in self.contexts:
+            for next_shot in self.contexts[context].next_shots:
+                next_context = (context + (next_shot.shot,))[-self.max_context:]
+                if next_context in self.contexts:
+                    next_shot.next_shots = self.contexts[next_context].next_shots
+                self.paths[id(next_shot)] = next_context
+
+    def use_tree(self, tree: Shot):
+        """
+            Register the context of every node of the tree the algorithms play on
+            (after clean_tree, compact_tree, ... so the ids are the ones of the final nodes)
+            Overlay nodes are not walked, that would create every node of the overlay,
+            lookup finds their context through their parents instead
+        """
+        if isinstance(tree, OverlayShot):
+            return
+        stack = [(shot, (shot.shot,)) for shot in tree.next_shots]
+        while stack:
+            node, path = stack.pop()
+            self.add_path(node, path[-self.max_context:])
+            for next_shot in node.next_shots:
+                stack.append((next_shot, path + (next_shot.shot,)))
+
+    def context_of(self, shot: Shot):
+        """
+            Context of a node, None if the index does not know it
+        """
+        path = self.paths.get(id(shot))
+        if path is None and isinstance(shot, OverlayShot):
+            path = []
+            while shot.parent is not None and len(path) < self.max_context:
+                path.append(shot.shot)
+                shot = shot.parent
+            path = tuple(reversed(path)) or None
+        return path
+
+    def add_path(self, node: Shot, context: tuple):
+        """
+            Remember the context of a node
+            Nodes reachable through several paths (shared subtrees) keep the
+            part of the context that all of their paths agree on
+        """
+        key = id(node)
+        if key not in self.paths:
+            self.paths[key] = context
+            return
+        known = self.paths[key]
+        length = 0
+        while length < min(len(known), len(context)) and known[-1 - length] == context[-1 - length]:
+            length += 1
+        self.paths[key] = context[len(context) - length:]
+
+    def lookup(self, shot: Shot, min_options: int=1):
+        """
+            Returns the node for the longest context of this shot that has
+            at least min_support hits and min_options next shots
+            None if the shot is unknown or no context qualifies
+        """
+        path = self.context_of(shot)
+        if path is None:
+            return None
+        for length in range(len(path), 0, -1):
+            node = self.contexts.get(path[-length:])
+            if node is not None and node.num_hit >= self.min_support and len(node.next_shots) >= min_options:
+                return node
+        return None
@@ -0,0 +1,116 @@
+"""
+Export the shot tree for other tools
+
+The tree is streamed depth-first (preorder) and every node is written as soon
+as it is reached, only the nodes on the way down are kept around, so the
+export does not build anything in memory that grows with the size of the tree.
+
+NDJSON: one json object per line
+    {"id": 3, "parent": 2, "depth": 2, "kind": "node", "path": ["4", "f1"], "shot": "f1",
+     "num_hit": 10, "num_success": 8, "continue_prob": 0.8, "winner_prob": 0.1, "error_prob": 0.1,
+     "outcomes": {"continue": 8, "*": 1, "n": 1}}
+CSV: a node table and an edge table
+    nodes: id, parent, depth, kind, path (shots separated by spaces), shot, counts, probabilities, outcomes
+    edges: parent, child, shot, num_hit, share (fraction of the parent's next shots that were this shot)
+
+kind is "node" for a normal node and "other" for the other bucket of its parent
+(see Shot.fold_into_other), the head of the tree has id 0 and an empty path.
+Shared subtrees (compact_tree) are written once for every path that leads to them.
+
+"""
+import csv
+import json
+
+CHUNK_SIZE = 10000 # number of lines collected before they are written
+BUFFER_SIZE = 1 << 20
+NODE_COLUMNS = ("id", "parent", "depth", "kind", "path", "shot", "num_hit", "num_success", "continue_prob", "winner_prob", "error_prob", "outcomes")
+EDGE_COLUMNS = ("parent", "child", "shot", "num_hit", "share")
+
+def walk_tree(tree):
+    """
+        Generator of (id, parent id, depth, kind, path, share, node) for every node in depth-first order
+        share is the fraction of the parent's next shots (by num_hit) that were this node, None for the head
+    """
+    stack = [(tree, None, 0, "node", (), None)]
+    node_id = 0
+    while stack:
+        node, parent_id, depth, kind, path, share = stack.pop()
+        yield node_id, parent_id, depth, kind, path, share, node
+        if kind == "node":
+            total = sum(shot.num_hit for shot in node.next_shots)
+            for shot in reversed(node.next_shots):
+                stack.append((shot, node_id, depth + 1, "node", path + (shot.shot,), shot.num_hit / total if total else 0.0))
+            if node.other is not None:
+                stack.append((node.other, node_id, depth + 1, "other", path + (node.other.shot,), None))
+        node_id += 1
+
+def node_to_json(node_id: int, parent_id, depth: int, kind: str, path: tuple, node) -> str:
+    """
+        A node as one NDJSON line
+    """
+    return (
+        f'{{"id": {node_id}, "parent": {json.dumps(parent_id)}, "depth": {depth}, "kind": "{kind}", '
+        f'"path": {json.dumps(path)}, "shot": {json.dumps(node.shot)}, '
+        f'"num_hit": {node.num_hit}, "num_success": {node.num_success}, '
+        f'"continue_prob": {node.continue_prob!r}, "winner_prob": {node.winner_prob!r}, "error_prob": {node.error_prob!r}, '
+        f'"outcomes": {json.dumps(node.outcomes)}}}\n'
+    )
+
+def export_tree(tree, ndjson_path: str=None, nodes_path: str=None, edges_path: str=None, chunk_size: int=CHUNK_SIZE) -> int:
+    """
+        Write the tree to any of the given files in one pass
+            ndjson_path : NDJSON, one node per line
+            nodes_path  : csv node table
+            edges_path  : csv edge table
+        Returns the number of nodes written
+    """
+    files = []
+    try:
+        ndjson_file = nodes_writer = edges_writer = None
+        if ndjson_path is not None:
+            ndjson_file = open(ndjson_path, 'w', encoding='utf8', buffering=BUFFER_SIZE)
+            files.append(ndjson_file)
+        if nodes_path is not None:
+            nodes_file = open(nodes_path, 'w', encoding='utf8', newline='', buffering=BUFFER_SIZE)
+            files.append(nodes_file)
+            nodes_writer = csv.writer(nodes_file)
+            nodes_writer.writerow(NODE_COLUMNS)
+        if edges_path is not None:
+            edges_file = open(edges_path, 'w', encoding='utf8', newline='', buffering=BUFFER_SIZE)
+            files.append(edges_file)
+            edges_writer = csv.writer(edges_file)
+            edges_writer.writerow(EDGE_COLUMNS)
+
+        json_lines = []
+        node_rows = []
+        edge_rows = []
+        def flush():
+            if ndjson_file is not None:
+                ndjson_file.writelines(json_lines)
+            if nodes_writer is not None:
+                nodes_writer.writerows(node_rows)
+            if edges_writer is not None:
+                edges_writer.writerows(edge_rows)
+            json_lines.clear()
+            node_rows.clear()
+            edge_rows.clear()
+
+        num_nodes = 0
+        for node_id, parent_id, depth, kind, path, share, node in walk_tree(tree):
+            if ndjson_file is not None:
+                json_lines.append(node_to_json(node_id, parent_id, depth, kind, path, node))
+            if nodes_writer is not None:
+                outcomes = ",".join(f"{key}={node.outcomes[key]}" for key in node.outcomes)
+                node_rows.append((
+                    node_id, "" if parent_id is None else parent_id, depth, kind, " ".join(path), node.shot,
+                    node.num_hit, node.num_success, repr(node.continue_prob), repr(node.winner_prob), repr(node.error_prob), outcomes))
+            if edges_writer is not None and share is not None:
+                edge_rows.append((parent_id, node_id, node.shot, node.num_hit, repr(share)))
+            num_nodes += 1
+            if num_nodes % chunk_size == 0:
+                flush()
+        flush()
+        return num_nodes
+    finally:
+        for output in files:
+            output.close()
@@ -0,0 +1,197 @@
+"""
+Build a shot tree that does not have to fit in memory
+
+sort_data adds points to the tree in the order they are read, which jumps all
+over the tree and needs the whole tree in memory. The external build instead:
+    1. splits every point into its shots and writes them to sorted runs on disk
+    2. merges the runs, which gives every point sorted by its shots
+    3. builds the tree in one pass over the sorted points: all points that share
+       a beginning are next to each other, so only the nodes of the current
+       rally are kept in memory and a node is written to the tree file as soon
+       as no more points can reach it
+
+The nodes are written after their next shots (postorder), load_tree reads
+that order as well. Counts and probabilities are the same as the tree sort_data
+builds, next shots are ordered by the number of times they were hit.
+
+"""
+import os
+import sys
+import heapq
+import tempfile
+from tree import Shot, parse_individual_point, node_to_line, TREE_FILE_VERSION
+from parse_raw_data import read_raw_data
+
+RUN_SIZE = 200000 # number of points sorted in memory at a time
+SEPARATOR = "\x1f" # sorts before every character used in a shot, so shorter rallies come first
+
+def iter_point_data(raw_data, encoding="utf8"):
+    """
+        Same points as get_point_data, one at a time instead of in a list
+    """
+    for row in read_raw_data(raw_data, encoding=encoding):
+        yield row["1st"]
+        yield row["2nd"]
+
+def tokenize_point(point: str, valid_starts="456", ignored_points="SRPQ0;", max_depth=None) -> str:
+    """
+        The shots of a point as one line of a run file:
+            cleaned shots (separated by SEPARATOR) <TAB> raw shots (separated by spaces)
+        Stops at the same shots Shot.add_point stops at
+        Returns None if the point does not add anything to the tree
+    """
+    individual_points = parse_individual_point(point)
+    if not individual_points or not any(c in valid_starts for c in individual_points[0]):
+        return None
+    if max_depth is not None:
+        individual_points = individual_points[:max_depth]
+    cleaned = []
+    raw = []
+    for raw_shot in individual_points:
+        raw_shot = raw_shot.replace(" ", "")
+        if not raw_shot:
+            break
+        shot = Shot.from_str(raw_shot).shot
+        if any(s in ignored_points for s in shot):
+            break
+        cleaned.append(shot)
+        raw.append(raw_shot)
+    if not cleaned:
+        return None
+    return SEPARATOR.join(cleaned) + "\t" + " ".join(raw) + "\n"
+
+def write_runs(points, run_dir: str, run_size: int=RUN_SIZE, valid_starts="456", max_depth=None) -> list:
+    """
+        Write the tokenized points to sorted run files, returns their paths
+    """
+    run_paths = []
+    run = []
+    def flush():
+        run.sort()
+        run_path = os.path.join(run_dir, f"run-{len(run_paths):05d}.txt")
+        with open(run_path, 'w', encoding='utf8') as run_file:
+            run_file.writelines(run)
+        run_paths.append(run_path)
+        run.clear()
+    for point in points:
+        line = tokenize_point(point, valid_starts, max_depth=max_depth)
+        if line is None:
+            continue
+        run.append(line)
+        if len(run) >= run_size:
+            flush()
+    if run:
+        flush()
+    return run_paths
+
+def build_from_sorted(lines, tree_file) -> int:
+    """
+        Build the tree from sorted run lines, writing every node to tree_file
+        once it is finished (postorder)
+        Returns the number of nodes written
+    """
+    path = [Shot("Start", 1, 1, [])] # nodes of the current rally, path[0] is the head
+    cleaned_path = []
+    num_nodes = 0
+    for line in lines:
+        cleaned, raw = line.rstrip("\n").split("\t")
+        cleaned = cleaned.split(SEPARATOR)
+        raw = raw.split(" ")
+        shared = 0
+        while shared < min(len(cleaned), len(cleaned_path)) and cleaned[shared] == cleaned_path[shared]:
+            shared += 1
+        # everything below the shared part of the rally is finished
+        while len(cleaned_path) > shared:
+            tree_file.write(node_to_line(path.pop(), len(cleaned_path)))
+            cleaned_path.pop()
+            num_nodes += 1
+        for depth, raw_shot in enumerate(raw):
+            next_shot = Shot.from_str(raw_shot)
+            if depth < shared:
+                path[depth + 1].update(next_shot, sort=False)
+            else:
+                path.append(next_shot)
+                cleaned_path.append(cleaned[depth])
+    while path:
+        tree_file.write(node_to_line(path.pop(), len(path)))
+        num_nodes += 1
+    return num_nodes
+
+def build_tree_external(points, tree_path: str, run_size: int=RUN_SIZE, temp_dir=None, valid_starts="456", max_depth=None, metadata: dict={}) -> int:
+    """
+        Build the tree for the points and write it to tree_path (read it with load_tree)
+        The sorted runs are kept in a temporary directory inside temp_dir
+        Returns the number of nodes in the tree
+    """
+    with tempfile.TemporaryDirectory(dir=temp_dir) as run_dir:
+        run_paths = write_runs(points, run_dir, run_size, valid_starts, max_depth)
+        run_files = [open(run_path, 'r', encoding='utf8') for run_path in run_paths]
+        try:
+            with open(tree_path, 'w', encoding='utf8', buffering=1 << 20) as tree_file:
+                tree_file.write(f"# version\t{TREE_FILE_VERSION}\n")
+                tree_file.write("# order\tpost\n")
+                for key in metadata:
+                    tree_file.write(f"# {key}\t{metadata[key]}\n")
+                return build_from_sorted(heapq.merge(*run_files), tree_file)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+def usage(return_val):
+    print("""
+External Tree Builder:
+    USAGE: python3 external_build.py [FLAGS] [OPTIONS]
+    -f FILE             : raw data file
+    -o FILE             : tree file to write
+    -r RUN_SIZE         : number of points sorted in memory at a time
+    -tmp DIRECTORY      : where the sorted runs are stored while building
+    -depth DEPTH        : only build the tree DEPTH shots deep
+    -e ENCODING         : encoding of the raw file
+    -h                  : print out this message
+
+    DEFAULTS:
+    FILE (-f)           = data/raw/charting-m-points-2010s.csv
+    FILE (-o)           = data/trees/charting-m-points-2010s.csv.external.tree
+    RUN_SIZE            = 200000
+    DIRECTORY           = the system temporary directory
+    ENCODING            = windows-1252
+    """)
+    sys.exit(return_val)
+
+def main():
+    raw_path = "data/raw/charting-m-points-2010s.csv"
+    tree_path = None
+    run_size = RUN_SIZE
+    temp_dir = None
+    max_depth = None
+    encoding = "windows-1252"
+    arguments = sys.argv[1:]
+    try:
+        while arguments:
+            current_arg = arguments.pop(0)
+            if current_arg == '-h':
+                usage(0)
+            elif current_arg == '-f':
+                raw_path = arguments.pop(0)
+            elif current_arg == '-o':
+                tree_path = arguments.pop(0)
+            elif current_arg == '-r':
+                run_size = int(arguments.pop(0))
+            elif current_arg == '-tmp':
+                temp_dir = arguments.pop(0)
+            elif current_arg == '-depth':
+                max_depth = int(arguments.pop(0))
+            elif current_arg == '-e':
+                encoding = arguments.pop(0)
+            else:
+                usage(1)
+    except Exception:
+        usage(1)
+    if tree_path is None:
+        tree_path = os.path.join("data/trees/", os.path.basename(raw_path) + ".external.tree")
+    os.makedirs(os.path.dirname(tree_path) or ".", exist_ok=True)
+    num_nodes = build_tree_external(iter_point_data(raw_path, encoding), tree_path, run_size, temp_dir, max_depth=max_depth)
+    print("wrote", num_nodes, "nodes to", tree_path)
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,20 @@
 
 
 """
+import os
 import sys
 from tennis_algorithm import human_vs_human, human_vs_alg, alg_vs_alg # modes
 from tennis_algorithm import min_stat, max_stat, max_opponent_stat, min_opponent_stat # algorithms
-from tree import sort_data
+from tennis_algorithm import use_context_index
+from context_index import ContextIndex, MIN_SUPPORT
+from tree import Shot, sort_data, compact_tree, finalize_tree, load_tree
 from parse_raw_data import get_point_data
+from build_trees import build_trees, is_multi_file, TREE_DIRECTORY
+from player import ProfileStore
+from overlay import overlay_trees
+from external_build import build_tree_external, iter_point_data
+from match_log import MatchLog, MAX_SEED
+from sampling import sample_point_data
 
 def usage(return_val):
     print("""
@@ -24,9 +33,36 @@ Tennis Shot Tree
           -o                : use the stat on the opponent instead of ourselves
           -s    SCORE       : the score that the players are trying to reach
           -tree PATH        : path to the file used to build the tree
+                              a directory or glob builds one tree from every file it matches
+                              when -tree is given more than once, every tree after the first is
+                              layered on top of the first one (e.g. a player's tree over the general
+                              tree), their counts are combined wherever they have data for the same rally
+          -tour TOURS       : with a directory or glob, only use these tours (m, w) e.g. -tour m
+          -decade DECADES   : with a directory or glob, only use these decades e.g. -decade 2010s,2020s
+          -cache DIRECTORY  : where trees built from a directory or glob are cached
+          -profiles DIRECTORY : also count the shots, winners and mistakes of every player while
+                              building the first tree and save them in DIRECTORY (single files only)
           -e    ENCODING    : encoding used on data file
+          -j    WORKERS     : number of processes used to read a single data file
           -v                : turn on verbose output
           -n NUM_NODES      : the maximum number of next_shots any node can have
+          -budget NUM_NODES : prune the tree while it is being built so it never holds
+                              more than NUM_NODES nodes (pruned shots are kept as counts)
+          -depth DEPTH      : only build the tree DEPTH shots deep
+          -external RUN_SIZE : build the tree from sorted runs of RUN_SIZE points on disk instead
+                              of in memory, the tree file is written to the -cache DIRECTORY
+                              (not with -sample or -budget, -profiles and -j are ignored)
+          -context K        : when a node has too little data, back off to the next shots seen
+                              after the last 1..K shots of the rally instead of searching the tree
+          -support SUPPORT  : number of times a context has to be seen before -context uses it
+          -compact          : share identical subtrees of the tree to save memory
+          -sample FRACTION  : build the tree from a seeded sample of FRACTION of the points (single files only)
+                              for quick experiments, see sampling.py for how far it is from the full tree
+          -sample-by METHOD : how the points are sampled: match (the same fraction of every match)
+                              or uniform (every point equally likely)
+          -sample-seed SEED : seed of the sample
+          -log FILE         : write the match (algorithms only) to a match log, see match_log.py
+          -seed SEED        : seed the match so it can be played again (0 to 2**64 - 1)
 
           STAT
             num_hit         : the number of times a specific shot was seen
@@ -39,6 +75,10 @@ Tennis Shot Tree
             SCORE           = 10
             PATH            = data/raw/charting-m-points-2010s.csv
             ENCODING        = windows-1252
+            DIRECTORY       = data/trees/
+            SUPPORT         = 10
+            METHOD          = match
+            SEED (-sample-seed) = 0
           
           MINMAX ALGORITHMS
             The maximization and minimization algorithms operate on a single
@@ -57,6 +97,133 @@ Tennis Shot Tree
     sys.exit(return_val)
 
 
+TREE_FLAGS = { # flags that change the tree the algorithms play on -> number of values they take
+    '-tree': 1, '-tour': 1, '-decade': 1, '-cache': 1, '-e': 1, '-n': 1,
+    '-budget': 1, '-depth': 1, '-external': 1, '-context': 1, '-support': 1,
+    '-compact': 0, '-sample': 1, '-sample-by': 1, '-sample-seed': 1,
+}
+
+def build_search_tree(tree_arguments: list, workers: int=1, profile_dir=None, verbose=False) -> Shot:
+    """
+        Build the tree described by the tree flags (see TREE_FLAGS) and set up the context index
+        The flags are kept in match logs so a logged match can be played again on the same tree
+    """
+    arguments = list(tree_arguments)
+    tree_paths = []
+    encoding = 'windows-1252' # disgusting, I know
+    max_nodes = 6
+    node_budget = None
+    tours = []
+    decades = []
+    cache_dir = TREE_DIRECTORY
+    max_depth = None
+    max_context = 0
+    min_support = MIN_SUPPORT
+    compact = False
+    external_run_size = None
+    sample_fraction = None
+    sample_method = "match"
+    sample_seed = 0
+    while arguments:
+        current_arg = arguments.pop(0)
+        if current_arg == '-tree':
+            tree_paths.append(arguments.pop(0))
+        elif current_arg == '-context':
+            max_context = int(arguments.pop(0))
+        elif current_arg == '-support':
+            min_support = int(arguments.pop(0))
+        elif current_arg == '-compact':
+            compact = True
+        elif current_arg == '-tour':
+            tours = arguments.pop(0).split(",")
+        elif current_arg == '-decade':
+            decades = arguments.pop(0).split(",")
+        elif current_arg == '-cache':
+            cache_dir = arguments.pop(0)
+        elif current_arg == '-e':
+            encoding = arguments.pop(0)
+        elif current_arg == '-n':
+            max_nodes = int(arguments.pop(0))
+        elif current_arg == '-budget':
+            node_budget = int(arguments.pop(0))
+        elif current_arg == '-depth':
+            max_depth = int(arguments.pop(0))
+        elif current_arg == '-external':
+            external_run_size = int(arguments.pop(0))
+        elif current_arg == '-sample':
+            sample_fraction = float(arguments.pop(0))
+        elif current_arg == '-sample-by':
+            sample_method = arguments.pop(0)
+        elif current_arg == '-sample-seed':
+            sample_seed = int(arguments.pop(0))
+        else:
+            raise ValueError(f"unknown tree flag '{current_arg}'")
+
+    if sample_fraction is not None and not 0 < sample_fraction <= 1:
+        raise ValueError("-sample has to be a fraction of the points, more than 0 and at most 1")
+    if external_run_size is not None and (sample_fraction is not None or node_budget is not None):
+        raise ValueError("-external builds the whole tree on disk, it can not be combined with -sample or -budget")
+
+    # build tree
+    if not tree_paths:
+        tree_paths = ['data/raw/charting-m-points-2010s.csv']
+    layers = []
+    context_index = None
+    for layer_number, tree_path in enumerate(tree_paths):
+        print("building search tree from", tree_path)
+        if is_multi_file(tree_path):
+            if profile_dir is not None and layer_number == 0:
+                print("-profiles only works when the tree is built from a single file, no profiles will be saved")
+            tree = build_trees(tree_path, tours, decades, cache_dir, encoding, node_budget, max_depth, verbose)
+            if tree is None:
+                sys.exit(1)
+        elif external_run_size is not None:
+            if profile_dir is not None and layer_number == 0:
+                print("-profiles does not work with -external, no profiles will be saved")
+            if workers > 1 and layer_number == 0:
+                print("-j does not work with -external, the file is read by a single process")
+            os.makedirs(cache_dir, exist_ok=True)
+            tree_file = os.path.join(cache_dir, os.path.basename(tree_path) + ".external.tree")
+            build_tree_external(iter_point_data(tree_path, encoding), tree_file, external_run_size, max_depth=max_depth)
+            tree = load_tree(tree_file)
+        elif sample_fraction is not None:
+            if profile_dir is not None and layer_number == 0:
+                print("-profiles does not work with -sample, no profiles will be saved")
+            tree = sort_data(
+                sample_point_data(tree_path, sample_fraction, sample_seed, sample_method, encoding=encoding, workers=workers),
+                max_nodes=node_budget,
+                max_depth=max_depth)
+        else:
+            profiles = ProfileStore(profile_dir) if profile_dir is not None and layer_number == 0 else None
+            tree = sort_data(
+                get_point_data(tree_path, encoding=encoding, workers=workers, players=profiles is not None),
+                max_nodes=node_budget,
+                max_depth=max_depth,
+                profiles=profiles)
+            if profiles is not None:
+                profiles.save()
+        if len(tree_paths) == 1:
+            if max_context > 0:
+                # count the contexts before clean_tree drops the rare shots they pool
+                context_index = ContextIndex(tree, max_context, min_support)
+            tree.clean_tree(max_nodes)
+        if compact:
+            tree = compact_tree(tree)
+        layers.append(tree)
+    if len(layers) == 1:
+        search_tree = layers[0]
+        finalize_tree(search_tree)
+    else:
+        # the layers are not cleaned, the overlay limits the number of next_shots instead
+        search_tree = overlay_trees(layers, max_keep=max_nodes)
+    if max_context > 0:
+        if context_index is None:
+            # counted from the layers, the overlay itself stays lazy
+            context_index = ContextIndex(layers, max_context, min_support)
+        context_index.use_tree(search_tree)
+    use_context_index(context_index)
+    return search_tree
+
 def main():
     """
         Interaction with the algorithms
@@ -66,13 +233,15 @@ def main():
     # take command line arguments
     arguments = sys.argv[1:]
     humans = 0
-    tree_path = 'data/raw/charting-m-points-2010s.csv'
-    encoding = 'windows-1252' # disgusting, I know
+    tree_arguments = [] # flags that describe the tree, see build_search_tree
     algs = []
     stats = []
     max_score = 10
     verbose = False
-    max_nodes = 6
+    workers = 1
+    profile_dir = None
+    log_path = None
+    seed = None
     try:
         while arguments:
             current_arg = arguments.pop(0)
@@ -100,25 +269,33 @@ def main():
                 stats.append(arguments.pop(0))
             elif current_arg == '-s':
                 max_score = int(arguments.pop(0))
-            elif current_arg == '-tree':
-                tree_path = arguments.pop(0)
-            elif current_arg == '-e':
-                encoding = arguments.pop(0)
+            elif current_arg in TREE_FLAGS:
+                tree_arguments.append(current_arg)
+                for _ in range(TREE_FLAGS[current_arg]):
+                    tree_arguments.append(arguments.pop(0))
+            elif current_arg == '-profiles':
+                profile_dir = arguments.pop(0)
+            elif current_arg == '-j':
+                workers = int(arguments.pop(0))
             elif current_arg == '-v':
                 verbose = True
-            elif current_arg == '-n':
-                max_nodes = int(arguments.pop(0))
+            elif current_arg == '-log':
+                log_path = arguments.pop(0)
+            elif current_arg == '-seed':
+                seed = int(arguments.pop(0))
+                if not 0 <= seed <= MAX_SEED:
+                    raise ValueError(f"-seed has to be between 0 and {MAX_SEED}")
             else:
                 usage(1)
-            
     except Exception as e:
         print(e)
         usage(1)
-    
-    # build tree
-    print("building search tree from", tree_path)
-    search_tree = sort_data(get_point_data(tree_path, encoding=encoding))
-    search_tree.clean_tree(max_nodes)
+
+    try:
+        search_tree = build_search_tree(tree_arguments, workers, profile_dir, verbose)
+    except ValueError as e:
+        print(e)
+        usage(1)
     print("done")
     if humans == 1:
         if len(algs) >= 1 and len(stats) >= 1:
@@ -127,11 +304,17 @@ def main():
             usage(1)
     elif humans == 0:
         if len(algs) >= 2 and len(stats) >= 2:
-            alg_vs_alg(search_tree, algs[:2], stats[:2], max_score, verbose)
+            log = MatchLog(log_path, tree_arguments) if log_path is not None else None
+            try:
+                alg_vs_alg(search_tree, algs[:2], stats[:2], max_score, verbose, seed=seed, log=log)
+            finally:
+                # a match that crashed is dropped, the log stays readable
+                if log is not None:
+                    log.close()
         else:
             usage(1)
     else:
         human_vs_human(search_tree, max_score, verbose)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,362 @@
+"""
+Compact binary log of simulated matches
+
+alg_vs_alg can write every match it plays to a MatchLog. The log can be
+replayed, summarized (rally lengths, per-shot and per-strategy statistics)
+without the tree, and a logged match can be verified by playing it again
+from its seed on the same tree.
+
+File format: the bytes b"TSTLOG1\n" followed by records that start with a one byte tag
+    T   tree        : u32 length, the tree flags of main.py (utf8, separated by tabs), first record of the log
+    S   string      : u32 id, u16 length, utf8 bytes (shot and strategy names are only written once)
+    M   match start : u64 seed, u32 strategy 1 id, u32 strategy 2 id, u16 max score, u8 first server (0/1)
+    H   shot        : u32 node id, u32 shot name id, u8 player (0/1), u8 outcome
+    P   point end   : u8 player that won the point, u16 player 1 score, u16 player 2 score
+    E   match end   : u16 player 1 score, u16 player 2 score
+node ids number the nodes of a match in the order they are first hit (0, 1, 2, ...),
+the same node keeps its id for the whole match, so playing the match again on the
+same tree gives the same ids without the tree ever being walked
+everything is little endian
+
+"""
+import os
+import sys
+import struct
+
+MAGIC = b"TSTLOG1\n"
+MAX_SEED = 2 ** 64 - 1 # seeds are stored as u64
+CONTINUE, WINNER, ERROR = 0, 1, 2
+OUTCOME_NAMES = ("continue", "winner", "error")
+BUFFER_SIZE = 1 << 16
+
+SETTINGS = struct.Struct("<cI")
+STRING = struct.Struct("<cIH")
+MATCH_START = struct.Struct("<cQIIHB")
+SHOT = struct.Struct("<cIIBB")
+POINT_END = struct.Struct("<cBHH")
+MATCH_END = struct.Struct("<cHH")
+
+class MatchLog:
+    """
+        Writes match events to a log file (or any binary file object)
+        tree_arguments are the flags the tree was built with (see main.build_search_tree)
+        so verify can build it again
+    """
+    def __init__(self, output, tree_arguments: list=None):
+        if isinstance(output, str):
+            self.file = open(output, 'wb')
+            self.owns_file = True
+        else:
+            self.file = output
+            self.owns_file = False
+        self.node_ids = {} # id(node) -> node id in the current match
+        self.nodes = [] # nodes of the current match, keeps them alive so their id() is not reused
+        self.strings = {}
+        self.buffer = bytearray(MAGIC)
+        if tree_arguments is not None:
+            data = "\t".join(tree_arguments).encode('utf8')
+            self.buffer += SETTINGS.pack(b"T", len(data))
+            self.buffer += data
+        self.match_start = None # (buffer position, number of strings) when the current match started
+
+    def string_id(self, text: str) -> int:
+        try:
+            return self.strings[text]
+        except KeyError:
+            string_id = self.strings[text] = len(self.strings)
+            data = text.encode('utf8')
+            self.buffer += STRING.pack(b"S", string_id, len(data))
+            self.buffer += data
+            return string_id
+
+    def start_match(self, seed: int, strategies: list, max_score: int, server: int):
+        """
+            server is 1 for player 1 and -1 for player 2 (like alg_vs_alg)
+        """
+        self.node_ids = {}
+        self.nodes = []
+        self.match_start = (len(self.buffer), len(self.strings))
+        self.buffer += MATCH_START.pack(
+            b"M", seed, self.string_id(strategies[0]), self.string_id(strategies[1]),
+            max_score, 0 if server > 0 else 1)
+
+    def node_id(self, node) -> int:
+        try:
+            return self.node_ids[id(node)]
+        except KeyError:
+            node_id = self.node_ids[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+            return node_id
+
+    def shot(self, node, player: int, outcome: int):
+        self.buffer += SHOT.pack(b"H", self.node_id(node), self.string_id(node.shot), player, outcome)
+
+    def point(self, winner: int, score: tuple):
+        self.buffer += POINT_END.pack(b"P", winner, score[0], score[1])
+
+    def end_match(self, score: tuple):
+        self.buffer += MATCH_END.pack(b"E", score[0], score[1])
+        self.match_start = None
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def abort_match(self):
+        """
+            Drop the events of a match that did not finish (e.g. an algorithm crashed)
+            Matches are only written to the file once they are finished
+        """
+        if self.match_start is None:
+            return
+        position, num_strings = self.match_start
+        del self.buffer[position:]
+        for text in [text for text, string_id in self.strings.items() if string_id >= num_strings]:
+            del self.strings[text]
+        self.match_start = None
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        self.abort_match()
+        self.flush()
+        if self.owns_file:
+            self.file.close()
+
+def read_log(data: bytes):
+    """
+        Generator of the events in a log (the contents of a log file)
+            ("settings", tree flags)
+            ("match", seed, strategy 1, strategy 2, max score, first server)
+            ("shot", node id, shot, player, outcome)
+            ("point", winner, player 1 score, player 2 score)
+            ("end", player 1 score, player 2 score)
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("not a match log")
+    strings = {}
+    position = len(MAGIC)
+    while position < len(data):
+        tag = data[position:position + 1]
+        if tag == b"H":
+            _, node_id, shot_id, player, outcome = SHOT.unpack_from(data, position)
+            position += SHOT.size
+            yield "shot", node_id, strings[shot_id], player, outcome
+        elif tag == b"P":
+            _, winner, score_1, score_2 = POINT_END.unpack_from(data, position)
+            position += POINT_END.size
+            yield "point", winner, score_1, score_2
+        elif tag == b"S":
+            _, string_id, length = STRING.unpack_from(data, position)
+            position += STRING.size
+            strings[string_id] = data[position:position + length].decode('utf8')
+            position += length
+        elif tag == b"M":
+            _, seed, strategy_1, strategy_2, max_score, server = MATCH_START.unpack_from(data, position)
+            position += MATCH_START.size
+            yield "match", seed, strings[strategy_1], strings[strategy_2], max_score, server
+        elif tag == b"E":
+            _, score_1, score_2 = MATCH_END.unpack_from(data, position)
+            position += MATCH_END.size
+            yield "end", score_1, score_2
+        elif tag == b"T":
+            _, length = SETTINGS.unpack_from(data, position)
+            position += SETTINGS.size
+            text = data[position:position + length].decode('utf8')
+            position += length
+            yield "settings", tuple(text.split("\t")) if text else ()
+        else:
+            raise ValueError(f"unknown record {tag!r} at byte {position}")
+
+def read_log_file(path: str):
+    with open(path, 'rb') as log_file:
+        yield from read_log(log_file.read())
+
+def read_matches(events) -> list:
+    """
+        Group events into matches, every match is a list of events starting with its "match" event
+    """
+    matches = []
+    for event in events:
+        if event[0] == "settings":
+            continue
+        if event[0] == "match":
+            matches.append([])
+        matches[-1].append(event)
+    return matches
+
+def read_settings(events):
+    """
+        Tree flags the log was written with, None if the log does not have them
+    """
+    for event in events:
+        if event[0] == "settings":
+            return list(event[1])
+        return None
+    return None
+
+def summarize(events) -> dict:
+    """
+        Aggregate logged matches without the tree
+        Returns a dict with:
+            rally_lengths   : dict[int, int]    = number of points with that many shots
+            shots           : dict[str, list]   = shot -> [times hit, winners, errors]
+            strategies      : dict[str, list]   = strategy -> [matches, matches won, points, points won, shots, winners, errors]
+    """
+    rally_lengths = {}
+    shots = {}
+    strategies = {}
+    players = None
+    rally = 0
+    for event in events:
+        kind = event[0]
+        if kind == "shot":
+            _, node_id, shot, player, outcome = event
+            rally += 1
+            counts = shots.setdefault(shot, [0, 0, 0])
+            counts[0] += 1
+            strategy = strategies[players[player]]
+            strategy[4] += 1
+            if outcome == WINNER:
+                counts[1] += 1
+                strategy[5] += 1
+            elif outcome == ERROR:
+                counts[2] += 1
+                strategy[6] += 1
+        elif kind == "point":
+            rally_lengths[rally] = rally_lengths.get(rally, 0) + 1
+            rally = 0
+            for player in (0, 1):
+                strategies[players[player]][2] += 1
+            strategies[players[event[1]]][3] += 1
+        elif kind == "match":
+            players = (event[2], event[3])
+            for strategy in players:
+                strategies.setdefault(strategy, [0, 0, 0, 0, 0, 0, 0])[0] += 1
+        elif kind == "end":
+            strategies[players[0 if event[1] > event[2] else 1]][1] += 1
+    return {"rally_lengths": rally_lengths, "shots": shots, "strategies": strategies}
+
+def replay_match(match_events: list, tree) -> list:
+    """
+        Play a logged match again from its seed and return the new events
+        The tree has to be built the same way as when the match was logged
+    """
+    import io
+    import contextlib
+    from tennis_algorithm import alg_vs_alg
+    from tennis_algorithm import min_stat, max_stat, max_opponent_stat, min_opponent_stat
+    algorithms = {f.__name__: f for f in (min_stat, max_stat, max_opponent_stat, min_opponent_stat)}
+    _, seed, strategy_1, strategy_2, max_score, server = match_events[0]
+    algorithm_1, stat_1 = strategy_1.split(":")
+    algorithm_2, stat_2 = strategy_2.split(":")
+    output = io.BytesIO()
+    log = MatchLog(output)
+    with contextlib.redirect_stdout(io.StringIO()):
+        alg_vs_alg(tree, [algorithms[algorithm_1], algorithms[algorithm_2]], [stat_1, stat_2], max_score, seed=seed, log=log)
+    log.close()
+    return list(read_log(output.getvalue()))
+
+def verify_match(match_events: list, tree) -> bool:
+    """
+        True if playing the match again from its seed gives exactly the logged events
+    """
+    try:
+        return replay_match(match_events, tree) == match_events
+    except Exception:
+        return False
+
+def usage(return_val):
+    print("""
+Match Log Reader:
+    USAGE: python3 match_log.py [FLAGS] [OPTIONS]
+    -f FILE             : log file written by alg_vs_alg (see -log in main.py)
+    -t TASK             : what to do with the log
+    -h                  : print out this message
+
+    DEFAULTS:
+    TASK                = summary
+
+    SUPPORTED TASKS:
+    summary             : rally length histogram, per-shot and per-strategy statistics
+    replay              : print every logged match shot by shot
+    verify              : build the tree again with the flags stored in the log, play every logged
+                          match again from its seed and check it matches the log
+                          (the raw files the tree was built from must not have changed)
+    """)
+    sys.exit(return_val)
+
+def main():
+    log_path = None
+    task = "summary"
+    arguments = sys.argv[1:]
+    try:
+        while arguments:
+            current_arg = arguments.pop(0)
+            if current_arg == '-h':
+                usage(0)
+            elif current_arg == '-f':
+                log_path = arguments.pop(0)
+            elif current_arg == '-t':
+                task = arguments.pop(0)
+            else:
+                usage(1)
+    except Exception:
+        usage(1)
+    if log_path is None or not os.path.exists(log_path):
+        print("no log file given")
+        usage(1)
+    try:
+        events = list(read_log_file(log_path))
+    except (ValueError, struct.error) as e:
+        print(f"{log_path} is not a readable match log ({e})")
+        usage(1)
+
+    if task == "summary":
+        summary = summarize(events)
+        print("rally length\tpoints")
+        for length in sorted(summary["rally_lengths"]):
+            print(f"{length}\t\t{summary['rally_lengths'][length]}")
+        print("\nshot\ttimes hit\twinner rate\terror rate")
+        shots = summary["shots"]
+        for shot in sorted(shots, key=lambda x: shots[x][0], reverse=True):
+            hits, winners, errors = shots[shot]
+            print(f"{shot}\t{hits}\t\t{winners / hits:.3f}\t\t{errors / hits:.3f}")
+        print("\nstrategy\t\t\tmatches\twon\tpoints\twon\tshots\twinners\terrors")
+        strategies = summary["strategies"]
+        for strategy in sorted(strategies):
+            print(f"{strategy:<32}" + "\t".join(str(count) for count in strategies[strategy]))
+    elif task == "replay":
+        for event in events:
+            if event[0] == "settings":
+                print("tree:", " ".join(event[1]) or "(default)")
+            elif event[0] == "match":
+                print(f"match: {event[2]} vs {event[3]} (seed {event[1]}, first to {event[4]}, player {event[5] + 1} serves first)")
+            elif event[0] == "shot":
+                print(f"  player {event[3] + 1} hit: {event[2]}\t{OUTCOME_NAMES[event[4]]}")
+            elif event[0] == "point":
+                print(f"point to player {event[1] + 1}: {event[2]} - {event[3]}")
+            else:
+                print(f"final score: {event[1]} - {event[2]}")
+    elif task == "verify":
+        from main import build_search_tree
+        tree_arguments = read_settings(events)
+        if tree_arguments is None:
+            print("the log does not say how its tree was built, it can not be verified")
+            sys.exit(1)
+        tree = build_search_tree(tree_arguments)
+        matches = read_matches(events)
+        failed = 0
+        for number, match_events in enumerate(matches, start=1):
+            if not verify_match(match_events, tree):
+                failed += 1
+                print("match", number, "does not match its replay")
+        print(len(matches) - failed, "of", len(matches), "matches verified")
+        if failed:
+            sys.exit(1)
+    else:
+        print("unknown task:", task)
+        usage(1)
+
+if __name__ == "__main__":
+    main()
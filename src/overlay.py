@@ -0,0 +1,164 @@
+"""
+Overlay trees: several shot trees used as if they were one
+
+An overlay layers one or more trees (player, surface, era, ...) on top of a
+base tree. Nodes are resolved lazily: the next shots of an overlay node are
+the next shots of that path in any of the layers, and the counts of a node
+are the counts of that path added up over the layers.
+
+Nothing is copied. The first time an overlay node is modified, an empty node
+is created for it (and for its parents) in a separate delta tree and the
+change is written there, the layers themselves are never modified.
+
+"""
+from tree import Shot
+
+class OverlayShot(Shot):
+    """
+        A node of an overlay tree, can be used anywhere a Shot is read
+        Contains:
+            layers      : list[Shot]    = the node for this path in each layer, None where a layer has no data
+            parent      : OverlayShot   = node above this one (None for the head)
+            delta       : Shot          = copy-on-write node holding the changes made to this node
+            max_keep    : int           = maximum number of next shots (like clean_tree), None for no limit
+    """
+    def __init__(self, layers: list, parent=None, max_keep=None, delta=None):
+        self.layers = layers
+        self.parent = parent
+        self.max_keep = max_keep
+        self.delta = delta
+        self.other = None
+        self.columns = None
+        self._stats = None
+        self._next_shots = None
+
+    def present(self) -> list:
+        """
+            The nodes that hold data for this path (layers and delta)
+        """
+        nodes = [layer for layer in self.layers if layer is not None]
+        if self.delta is not None:
+            nodes.append(self.delta)
+        return nodes
+
+    def stats(self) -> Shot:
+        """
+            Node holding the combined counts and probabilities of this path
+            A path that only one layer has data for uses that layer's node as is
+        """
+        if self._stats is None:
+            nodes = self.present()
+            if len(nodes) == 1:
+                self._stats = nodes[0]
+            else:
+                combined = Shot(nodes[0].shot, 0, 0, [], {})
+                for node in nodes:
+                    combined.num_hit += node.num_hit
+                    for outcome in node.outcomes:
+                        try:
+                            combined.outcomes[outcome] += node.outcomes[outcome]
+                        except KeyError:
+                            combined.outcomes[outcome] = node.outcomes[outcome]
+                combined.update_probabilities()
+                self._stats = combined
+        return self._stats
+
+    @property
+    def shot(self):
+        return self.present()[0].shot
+
+    @property
+    def num_hit(self):
+        return self.stats().num_hit
+
+    @property
+    def num_success(self):
+        return self.stats().num_success
+
+    @property
+    def outcomes(self):
+        return self.stats().outcomes
+
+    @property
+    def continue_prob(self):
+        return self.stats().continue_prob
+
+    @property
+    def winner_prob(self):
+        return self.stats().winner_prob
+
+    @property
+    def error_prob(self):
+        return self.stats().error_prob
+
+    @property
+    def next_shots(self):
+        """
+            Union of the next shots of every layer, most hit first
+        """
+        if self._next_shots is None:
+            layers = self.layers + [self.delta]
+            children = {} # shot -> the node for that shot in each layer
+            for index, layer in enumerate(layers):
+                if layer is None:
+                    continue
+                for next_shot in layer.next_shots:
+                    if next_shot.shot not in children:
+                        children[next_shot.shot] = [None] * len(layers)
+                    children[next_shot.shot][index] = next_shot
+            next_shots = [
+                OverlayShot(nodes[:-1], self, self.max_keep, nodes[-1])
+                for nodes in children.values()
+            ]
+            next_shots.sort(key=lambda x: x.num_hit, reverse=True)
+            if self.max_keep is not None:
+                next_shots = next_shots[:self.max_keep]
+            self._next_shots = next_shots
+        return self._next_shots
+
+    def materialize(self) -> Shot:
+        """
+            Copy-on-write: returns the delta node of this path,
+            creating it (and the delta nodes above it) the first time
+        """
+        if self.delta is None:
+            if self.parent is None:
+                self.delta = Shot(self.shot, 0, 0, [], {})
+            else:
+                parent_delta = self.parent.materialize()
+                for next_shot in parent_delta.next_shots:
+                    if next_shot.shot == self.shot:
+                        self.delta = next_shot
+                        break
+                else:
+                    self.delta = Shot(self.shot, 0, 0, [], {})
+                    parent_delta.next_shots.append(self.delta)
+        return self.delta
+
+    def invalidate(self):
+        """
+            Forget the combined values after a modification
+            (overlay nodes below this one that were handed out earlier are not updated)
+        """
+        self._stats = None
+        self._next_shots = None
+
+    def update(self, shot, sort=True, rally_continues: list=["7", "8", "9", "continue"]):
+        self.materialize().update(shot, sort, rally_continues)
+        self.invalidate()
+        return self
+
+    def add_next_shot(self, next_shot, sort=True, require_direction=True):
+        self.materialize().add_next_shot(next_shot, sort, require_direction)
+        self.invalidate()
+
+    def add_point(self, shots: list, ignored_points="SRPQ0;", max_depth=None, profiles=None, players=None, index=0) -> int:
+        added = self.materialize().add_point(shots, ignored_points, max_depth, profiles, players, index)
+        self.invalidate()
+        return added
+
+def overlay_trees(trees: list, max_keep=None) -> OverlayShot:
+    """
+        Overlay trees[1:] on top of the base tree trees[0]
+    """
+    return OverlayShot(list(trees), max_keep=max_keep)
@@ -2,10 +2,15 @@
 Parse raw data and perform associated tasks
 
 """
+import io
 import os
 import sys
 import csv
-from tree import sort_data, parse_individual_point
+from concurrent.futures import ProcessPoolExecutor
+from tree import sort_data, parse_individual_point, compact_tree, tree_size
+from player import ProfileStore, PROFILE_DIRECTORY
+from query import QueryIndex
+from export import export_tree
 
 ENDINGS = { # True means you just won the point, False means you just lost it
     False: "nwdxg!V@#", # oh no, you missed :c
@@ -14,6 +19,8 @@ ENDINGS = { # True means you just won the point, False means you just lost it
 MIN_REQUIRED_SHOTS = 5 # the cutoff for items in the tree, if there are fewer than this many of that shot, it will be ignored
 RESTRICTED_SEARCH = True
 MAX_OPTIONS = 5
+EXPORT_DIRECTORY = "data/export/"
+POINT_COLUMNS = ("match_id", "1st", "2nd") # the only columns needed to build a tree
 def usage(return_val):
     print("""
 Raw Data Parser:
@@ -24,6 +31,9 @@ Raw Data Parser:
     -t TASK             : what the parser should do
     -e ENCODING         : encoding of the file being read in
     -eo ENCODING        : encoding of the output file
+    -j WORKERS          : read the file with this many worker processes
+    -p PLAYER           : player used by show_profile
+    -q QUERY            : query used by the query task, can be given more than once
     -h                  : print out this message
 
     DEFAULTS:
@@ -31,6 +41,7 @@ Raw Data Parser:
     RAW_FILE            = charting-m-points-2010s.csv
     OUTPUT_DIRECTORY    = data/data-sorted-by-player/
     TASK                = separate_by_player
+    WORKERS             = 1
 
     SUPPORTED TASKS:
     separate_by_player  : read the raw file and sort match data into specific player files (appends to the file, so chance of duplicate lines)
@@ -38,6 +49,17 @@ Raw Data Parser:
     parse_all_data      : split each point into individual shots and print the points to stdin
     create_tree         : generate a tree based on the given DIRECTORY/FILE specified by -d and -f
                           also allows the user to traverse the generated tree
+    compact_tree        : generate the tree for DIRECTORY/FILE, share its identical subtrees
+                          and report how much memory that saves
+    create_profiles     : generate the tree for DIRECTORY/FILE and save the shot/winner/mistake
+                          counts of every player to OUTPUT_DIRECTORY (data/profiles/ if -o is not given)
+    show_profile        : print the profile of PLAYER from OUTPUT_DIRECTORY
+    query               : generate the tree for DIRECTORY/FILE and print every rally that matches QUERY
+                          EXAMPLE: -q "depth=3..6 path=4*/*/f* winner_prob>0.2 num_hit>=50"
+                          see query.py for the full query language
+    export              : generate the tree for DIRECTORY/FILE and write every node to OUTPUT_DIRECTORY/FILE.ndjson
+                          (data/export/ if -o is not given), one json object per line, see export.py
+    export_csv          : same as export, but as a node table (FILE.nodes.csv) and an edge table (FILE.edges.csv)
     """)
     sys.exit(return_val)
 
@@ -67,16 +89,131 @@ def read_raw_data(raw_path: str, encoding="utf8") -> dict:
         for row in csv_reader:
             yield row
 
-def get_point_data(raw_data, encoding="utf8"):
+def find_record_boundaries(raw_path: str, num_chunks: int, block_size: int=1 << 20) -> list:
+    """
+        Split a csv file into (start, end) byte ranges that each hold whole records
+        The header line is not part of any range
+
+        A newline only ends a record if it is not inside a quoted field,
+        which is the case when an even number of quotes came before it.
+        Assumes an ascii compatible encoding (utf8, windows-1252, ...)
+    """
+    size = os.path.getsize(raw_path)
+    targets = [size * chunk // num_chunks for chunk in range(1, num_chunks)]
+    boundaries = []
+    quotes = 0 # number of quotes seen so far
+    seeking = True # looking for the end of a record (the header first)
+    offset = 0 # position of the current block in the file
+    with open(raw_path, 'rb') as raw_file:
+        while True:
+            block = raw_file.read(block_size)
+            if not block:
+                break
+            position = 0
+            while position < len(block):
+                if seeking:
+                    newline = block.find(b"\n", position)
+                    if newline == -1:
+                        quotes += block.count(b'"', position)
+                        break
+                    quotes += block.count(b'"', position, newline)
+                    position = newline + 1
+                    if quotes % 2 == 0:
+                        boundaries.append(offset + position)
+                        seeking = False
+                else:
+                    # skip to the next target that is not already covered
+                    while targets and targets[0] < boundaries[-1]:
+                        targets.pop(0)
+                    if not targets:
+                        break
+                    target = targets.pop(0) - offset
+                    if target >= len(block):
+                        targets.insert(0, target + offset)
+                        quotes += block.count(b'"', position)
+                        break
+                    quotes += block.count(b'"', position, target)
+                    position = target
+                    seeking = True
+            if not seeking and not targets:
+                break
+            offset += len(block)
+    if not boundaries:
+        return []
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def read_record_range(raw_path: str, start: int, end: int, column_indexes: list, encoding="utf8") -> list:
+    """
+        Decode and parse the records in one byte range of a csv file
+        Only the columns at column_indexes are kept (missing columns become None)
+
+        Runs inside a worker process
+    """
+    with open(raw_path, 'rb') as raw_file:
+        raw_file.seek(start)
+        text = raw_file.read(end - start).decode(encoding)
+    rows = []
+    for row in csv.reader(io.StringIO(text, newline=None)):
+        if not row:
+            continue # DictReader skips blank lines as well
+        rows.append(tuple(row[i] if i < len(row) else None for i in column_indexes))
+    return rows
+
+def read_raw_data_parallel(raw_path: str, encoding="utf8", workers: int=4, columns: tuple=POINT_COLUMNS):
+    """
+        Same rows as read_raw_data (in the same order) but only with the given columns
+        The file is split into byte ranges that are decoded and parsed by separate processes
+    """
+    with open(raw_path, 'r', encoding=encoding) as raw_file:
+        header = next(csv.reader(raw_file), None)
+    if header is None:
+        return
+    column_indexes = [header.index(column) for column in columns]
+    ranges = find_record_boundaries(raw_path, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(
+            read_record_range,
+            [raw_path] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            [column_indexes] * len(ranges),
+            [encoding] * len(ranges))
+        for chunk in chunks:
+            for row in chunk:
+                yield dict(zip(columns, row))
+
+def get_players(row: dict) -> tuple:
+    """
+        (server, returner) of a point, the names come from the match_id
+    """
+    player_1, player_2 = [player.strip("_") for player in row["match_id"].split('-')[-2:]]
+    if row["Svr"] == "2":
+        return player_2, player_1
+    return player_1, player_2
+
+def get_point_data(raw_data, encoding="utf8", workers=1, players=False):
     """
     returns just the point data, no distinction is made between points
     off first and second serves
+
+    with more than one worker the file is read with read_raw_data_parallel
+    with players=True every point is returned as (point, (server, returner))
     """
-    raw = read_raw_data(raw_data, encoding=encoding)
+    if workers > 1:
+        columns = POINT_COLUMNS + ("Svr",) if players else POINT_COLUMNS
+        raw = read_raw_data_parallel(raw_data, encoding=encoding, workers=workers, columns=columns)
+    else:
+        raw = read_raw_data(raw_data, encoding=encoding)
     points = []
     for row in raw:
-        points.append(row["1st"])
-        points.append(row["2nd"])
+        if players:
+            point_players = get_players(row)
+            points.append((row["1st"], point_players))
+            points.append((row["2nd"], point_players))
+        else:
+            points.append(row["1st"])
+            points.append(row["2nd"])
     return points
 
 
@@ -86,10 +223,13 @@ def main():
     """
     raw_data_directory = "data/data-sorted-by-player/"
     raw_data_file = "Roger_Federer.csv"
-    output_directory = "data/data-sorted-by-player/"
+    output_directory = None
     task = "create_tree"
+    player = None
+    queries = []
     encoding = "utf8"
     output_encoding = "utf8"
+    workers = 1
     # take command line arguments
     arguments = sys.argv[1:]
     try:
@@ -109,6 +249,12 @@ def main():
                 encoding  = arguments.pop(0)
             elif current_arg == '-eo':
                 output_encoding = arguments.pop(0)
+            elif current_arg == '-j':
+                workers = int(arguments.pop(0))
+            elif current_arg == '-p':
+                player = arguments.pop(0)
+            elif current_arg == '-q':
+                queries.append(arguments.pop(0))
             else:
                 usage(1)
     except Exception:
@@ -117,7 +263,7 @@ def main():
     if task == "separate_by_player":
         separate_by_player(
             raw_data_directory + raw_data_file, 
-            output_directory, 
+            output_directory or "data/data-sorted-by-player/", 
             encoding=encoding,
             output_encoding=output_encoding)
     elif task == "read_raw_data":
@@ -133,7 +279,7 @@ def main():
     
     elif task == "create_tree":
         data = sort_data(
-            get_point_data(raw_data_directory + raw_data_file, encoding=encoding)
+            get_point_data(raw_data_directory + raw_data_file, encoding=encoding, workers=workers)
             )
         print(data.shot)
         done = False
@@ -160,9 +306,59 @@ def main():
                 selected = selected.next_shots[index]
             except ValueError:
                 print("sorry that option was not found")
+    elif task == "compact_tree":
+        data = sort_data(
+            get_point_data(raw_data_directory + raw_data_file, encoding=encoding, workers=workers)
+            )
+        nodes_before, bytes_before = tree_size(data)
+        nodes_after, bytes_after = tree_size(compact_tree(data))
+        print(f"nodes: {nodes_before} -> {nodes_after} ({100 * (1 - nodes_after / nodes_before):.1f}% fewer)")
+        print(f"approximate bytes: {bytes_before} -> {bytes_after} ({100 * (1 - bytes_after / bytes_before):.1f}% less)")
+    elif task == "create_profiles":
+        profiles = ProfileStore(output_directory or PROFILE_DIRECTORY)
+        data = sort_data(
+            get_point_data(raw_data_directory + raw_data_file, encoding=encoding, workers=workers, players=True),
+            profiles=profiles
+            )
+        profiles.save()
+        print("saved", len(profiles.players), "profiles to", profiles.directory)
+    elif task == "show_profile":
+        profile = ProfileStore(output_directory or PROFILE_DIRECTORY).get(player)
+        if profile is None:
+            print("no profile found for", player)
+            sys.exit(1)
+        for shot in sorted(profile.shots, key=lambda x: profile.shots[x], reverse=True):
+            print(f'{shot}\tnumber of times hit: {profile.shots[shot]: 8d} | chance of winner:{profile.winner_rate(shot): 6.2f} | chance of mistake:{profile.error_rate(shot): 6.2f}')
+    elif task == "query":
+        data = sort_data(
+            get_point_data(raw_data_directory + raw_data_file, encoding=encoding, workers=workers)
+            )
+        index = QueryIndex(data)
+        for query in queries:
+            print("query:", query)
+            try:
+                num_found = 0
+                for path, shot in index.search(query):
+                    print(f'{" ".join(path)}\tnumber of times hit: {shot.num_hit: 10.2f} | chance the point continues:{shot.continue_prob: 6.2f} | chance of winner:{shot.winner_prob: 6.2f} | chance of mistake:{shot.error_prob: 6.2f}')
+                    num_found += 1
+                print(num_found, "rallies found")
+            except ValueError as e:
+                print("invalid query:", e)
+    elif task in ("export", "export_csv"):
+        data = sort_data(
+            get_point_data(raw_data_directory + raw_data_file, encoding=encoding, workers=workers)
+            )
+        output_directory = output_directory or EXPORT_DIRECTORY
+        os.makedirs(output_directory, exist_ok=True)
+        output_path = os.path.join(output_directory, raw_data_file)
+        if task == "export":
+            num_nodes = export_tree(data, ndjson_path=output_path + ".ndjson")
+            print("wrote", num_nodes, "nodes to", output_path + ".ndjson")
+        else:
+            num_nodes = export_tree(data, nodes_path=output_path + ".nodes.csv", edges_path=output_path + ".edges.csv")
+            print("wrote", num_nodes, "nodes to", output_path + ".nodes.csv", "and", output_path + ".edges.csv")
     else:
         print("unknown task:", task)
         usage(1)
-    # write them into an output file (json?)
 if __name__ == "__main__":
     main()
@@ -1,3 +1,12 @@
+"""
+Player data, used to target the weaknesses of specific players
+
+"""
+import os
+from tree import Shot
+
+PROFILE_DIRECTORY = "data/profiles/"
+
 class Player:
     """
         Class to store data about the player
@@ -37,4 +46,115 @@ class Player:
         try:
             self.shots[shot] += 1
         except Exception:
-            self.shots[shot] = 1
\ No newline at end of file
+            self.shots[shot] = 1
+    def error_rate(self, shot: str) -> float:
+        """
+            Fraction of the times this shot was hit that it was a mistake
+        """
+        if shot not in self.shots:
+            return 0
+        return self.mistakes.get(shot, 0) / self.shots[shot]
+
+    def winner_rate(self, shot: str) -> float:
+        """
+            Fraction of the times this shot was hit that it was a winner
+        """
+        if shot not in self.shots:
+            return 0
+        return self.winners.get(shot, 0) / self.shots[shot]
+
+    def weaknesses(self, min_shots: int=5) -> list:
+        """
+            Shots hit at least min_shots times, highest error rate first
+        """
+        shots = [shot for shot in self.shots if self.shots[shot] >= min_shots]
+        shots.sort(key=self.error_rate, reverse=True)
+        return shots
+
+class ProfileStore:
+    """
+        Shot/winner/mistake counts of every player
+
+        Filled in by Shot.add_point while sort_data builds the tree (see the profiles argument)
+        and saved as one file per player in directory, so a single profile can be
+        loaded without reading the others
+
+        File format (one line per count):
+            kind<TAB>shot<TAB>count     where kind is shot, winner or mistake
+    """
+    def __init__(self, directory: str=PROFILE_DIRECTORY):
+        self.directory = directory
+        self.players = {}
+
+    def add_shot(self, shot: Shot, name: str):
+        """
+            Count one shot (a node from Shot.from_str) for a player
+            Called by Shot.add_point while the tree is built, so every shot is only parsed once
+        """
+        try:
+            player = self.players[name]
+        except KeyError:
+            player = self.players[name] = Player(None)
+        player.add_shot(shot.shot)
+        if shot.num_success == 0:
+            player.add_mistake(shot.shot)
+        elif any('*' in outcome for outcome in shot.outcomes):
+            player.add_winner(shot.shot)
+
+    def add_point(self, shots: list, players: tuple, ignored_points="SRPQ0;", start: int=0):
+        """
+            Count the shots of a point (a list from parse_individual_point) without building a tree
+            players is (server, returner), the server hits every other shot starting with the serve,
+            start is the position of shots[0] in the rally
+            Stops at the same shots Shot.add_point stops at
+        """
+        for index, raw_shot in enumerate(shots, start=start):
+            raw_shot = raw_shot.replace(" ", "")
+            if not raw_shot:
+                return
+            shot = Shot.from_str(raw_shot)
+            if any(s in ignored_points for s in shot.shot):
+                return
+            self.add_shot(shot, players[index % 2])
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".tsv")
+
+    def save(self):
+        """
+            Write every profile in memory to the directory (replacing older profiles)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in self.players:
+            player = self.players[name]
+            with open(self.path(name), 'w', encoding='utf8') as profile_file:
+                for kind, counts in (("shot", player.shots), ("winner", player.winners), ("mistake", player.mistakes)):
+                    for shot in counts:
+                        profile_file.write(f"{kind}\t{shot}\t{counts[shot]}\n")
+
+    def get(self, name: str):
+        """
+            Profile of a player, loaded from the directory the first time it is asked for
+            None if there is no profile for that player
+        """
+        if name in self.players:
+            return self.players[name]
+        if not os.path.exists(self.path(name)):
+            return None
+        player = Player(None)
+        with open(self.path(name), 'r', encoding='utf8') as profile_file:
+            for line in profile_file:
+                kind, shot, count = line.rstrip("\n").split("\t")
+                counts = {"shot": player.shots, "winner": player.winners, "mistake": player.mistakes}[kind]
+                counts[shot] = int(count)
+        self.players[name] = player
+        return player
+
+    def names(self) -> list:
+        """
+            Every player that has a profile (in memory or in the directory)
+        """
+        names = set(self.players)
+        if os.path.isdir(self.directory):
+            names.update(f[:-len(".tsv")] for f in os.listdir(self.directory) if f.endswith(".tsv"))
+        return sorted(names)
@@ -0,0 +1,154 @@
+"""
+Query the shot tree for rally patterns
+
+A query is a list of clauses separated by spaces, a node has to match every clause:
+    depth=3..6          : depth of the node (the serve is depth 1), also depth=3, depth>=3, ...
+    path=4*/f*/*        : shot globs, one per depth separated by '/', the rally has to start
+                          with shots matching them (deeper shots can be anything)
+    winner_prob>0.2     : threshold on one of the stats of Shot.get_stat
+                          supported comparisons: > >= < <= =
+
+EXAMPLE: all 3-6 shot serve patterns with winner_prob > 0.2 and num_hit >= 50
+    depth=3..6 winner_prob>0.2 num_hit>=50
+
+QueryIndex stores the largest and smallest value of every stat in each subtree
+and how deep each subtree goes, so subtrees that can not contain a match are skipped
+
+"""
+import re
+import fnmatch
+import operator
+from tree import Shot, STATS
+
+CLAUSE = re.compile(r"^(\w+)(>=|<=|>|<|=)(.+)$")
+COMPARISONS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+}
+
+class Query:
+    """
+        Parsed query
+        Contains:
+            min_depth   : int
+            max_depth   : int (None for no limit)
+            path        : list[re.Pattern]  = compiled shot globs, one per depth
+            conditions  : list[tuple]       = (stat, comparison, value)
+    """
+    def __init__(self, text: str):
+        self.min_depth = 1
+        self.max_depth = None
+        self.path = []
+        self.conditions = []
+        for clause in text.split():
+            match = CLAUSE.match(clause)
+            if not match:
+                raise ValueError(f"could not understand '{clause}'")
+            name, comparison, value = match.groups()
+            if name == "path":
+                if comparison != "=":
+                    raise ValueError("path only supports '='")
+                self.path = [re.compile(fnmatch.translate(glob)) for glob in value.split("/")]
+            elif name == "depth":
+                self.add_depth(comparison, value)
+            elif name in STATS:
+                self.conditions.append((name, comparison, float(value)))
+            else:
+                raise ValueError(f"unknown field '{name}'")
+
+    def add_depth(self, comparison: str, value: str):
+        if comparison == "=" and ".." in value:
+            low, high = value.split("..")
+            self.min_depth = max(self.min_depth, int(low))
+            self.max_depth = int(high) if self.max_depth is None else min(self.max_depth, int(high))
+            return
+        depth = int(value)
+        if comparison in ("=", ">=", ">"):
+            self.min_depth = max(self.min_depth, depth + (comparison == ">"))
+        if comparison in ("=", "<=", "<"):
+            high = depth - (comparison == "<")
+            self.max_depth = high if self.max_depth is None else min(self.max_depth, high)
+
+    def matches(self, node: Shot, depth: int) -> bool:
+        """
+            Does the node itself match (the path is checked while walking the tree)
+        """
+        if depth < self.min_depth or (self.max_depth is not None and depth > self.max_depth):
+            return False
+        for stat, comparison, value in self.conditions:
+            if not COMPARISONS[comparison](node.get_stat(stat), value):
+                return False
+        return True
+
+    def can_match_below(self, bounds: tuple, depth: int) -> bool:
+        """
+            Can anything in a subtree (with the given bounds) starting at depth match
+        """
+        lowest, highest, height = bounds
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        if depth + height < self.min_depth:
+            return False
+        for stat, comparison, value in self.conditions:
+            if comparison in (">", ">=") and not COMPARISONS[comparison](highest[stat], value):
+                return False
+            if comparison in ("<", "<=") and not COMPARISONS[comparison](lowest[stat], value):
+                return False
+            if comparison == "=" and not lowest[stat] <= value <= highest[stat]:
+                return False
+        return True
+
+class QueryIndex:
+    """
+        Bounds of every subtree of a tree, keyed by the id of the subtree's top node
+        bounds: dict[int, tuple] = (lowest value of each stat, highest value of each stat, height)
+        where height is the number of levels below the node
+    """
+    def __init__(self, tree: Shot):
+        self.tree = tree
+        self.bounds = {}
+        stack = [(tree, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in self.bounds:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.extend((shot, False) for shot in node.next_shots)
+                continue
+            lowest = {stat: node.get_stat(stat) for stat in STATS}
+            highest = dict(lowest)
+            height = 0
+            for shot in node.next_shots:
+                shot_lowest, shot_highest, shot_height = self.bounds[id(shot)]
+                for stat in STATS:
+                    if shot_lowest[stat] < lowest[stat]:
+                        lowest[stat] = shot_lowest[stat]
+                    if shot_highest[stat] > highest[stat]:
+                        highest[stat] = shot_highest[stat]
+                height = max(height, shot_height + 1)
+            self.bounds[id(node)] = (lowest, highest, height)
+
+    def search(self, query):
+        """
+            Generator of (path, node) for every node that matches the query,
+            in depth-first order as they are found
+            query can be a Query or the text of one
+        """
+        if isinstance(query, str):
+            query = Query(query)
+        stack = [(shot, (shot.shot,)) for shot in reversed(self.tree.next_shots)]
+        while stack:
+            node, path = stack.pop()
+            depth = len(path)
+            if depth <= len(query.path) and not query.path[depth - 1].match(node.shot):
+                continue
+            if not query.can_match_below(self.bounds[id(node)], depth):
+                continue
+            if query.matches(node, depth):
+                yield path, node
+            for shot in reversed(node.next_shots):
+                stack.append((shot, path + (shot.shot,)))
@@ -0,0 +1,277 @@
+"""
+Build the tree from a sample of the points
+
+For quick experiments (clean_tree settings, new algorithms, ...) a tree built
+from a fraction of the points is often good enough. The points are sampled
+with a seed so the same sample can be built again:
+    match       : stratified by match_id, the fraction is taken from every match
+                  (at least one point each) so every match is represented
+    uniform     : a uniform sample of all points
+Both serves of a point are kept together.
+
+The counts in a sampled tree are counts of the sample, the probabilities are
+estimates: probability_intervals gives a confidence interval for each of them,
+and top_k_divergence compares the order of the next shots with the full tree.
+
+"""
+import sys
+import time
+from random import Random
+from tree import sort_data
+from parse_raw_data import get_point_data, read_raw_data, read_raw_data_parallel, POINT_COLUMNS
+from confidence import wilson_interval, Z_95
+
+SAMPLE_METHODS = ("match", "uniform")
+PROBABILITY_STATS = ("continue_prob", "winner_prob", "error_prob")
+
+def uniform_sample(rows, fraction: float, seed=0) -> list:
+    """
+        Sample the fraction of all rows, every row is equally likely
+        The sample is returned in the order the rows were read
+    """
+    rows = list(rows)
+    sample = Random(seed).sample(range(len(rows)), round(fraction * len(rows)))
+    sample.sort()
+    return [rows[position] for position in sample]
+
+def stratified_sample(rows, fraction: float, seed=0) -> list:
+    """
+        Sample the fraction of the rows of every match, at least one row per match
+        rows are tuples that start with the match_id
+        The sample is returned in the order the rows were read
+    """
+    random = Random(seed)
+    matches = {} # match_id -> positions of its rows
+    rows = list(rows)
+    for position, row in enumerate(rows):
+        matches.setdefault(row[0], []).append(position)
+    sample = []
+    for positions in matches.values():
+        size = max(1, round(fraction * len(positions)))
+        sample.extend(random.sample(positions, size))
+    sample.sort()
+    return [rows[position] for position in sample]
+
+def sample_point_data(raw_data, fraction: float, seed=0, method: str="match", encoding="utf8", workers=1) -> list:
+    """
+        Same as get_point_data, but only for a sample of the points
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"unknown sampling method '{method}'")
+    if workers > 1:
+        raw = read_raw_data_parallel(raw_data, encoding=encoding, workers=workers, columns=POINT_COLUMNS)
+    else:
+        raw = read_raw_data(raw_data, encoding=encoding)
+    # only the point columns are kept while the whole file is waiting to be sampled
+    raw = ((sys.intern(row["match_id"]), row["1st"], row["2nd"]) for row in raw)
+    if method == "match":
+        rows = stratified_sample(raw, fraction, seed)
+    else:
+        rows = uniform_sample(raw, fraction, seed)
+    points = []
+    for match_id, first, second in rows:
+        points.append(first)
+        points.append(second)
+    return points
+
+def probability_intervals(node, z: float=Z_95) -> dict:
+    """
+        Wilson confidence interval of each probability of a node
+        stat -> (low, high)
+    """
+    return {
+        stat: wilson_interval(round(node.get_stat(stat) * node.num_hit), node.num_hit, z)
+        for stat in PROBABILITY_STATS
+    }
+
+def walk_paths(tree, max_depth=None):
+    """
+        Generator of (path, node) for every node below the head, depth-first
+    """
+    stack = [((shot.shot,), shot) for shot in reversed(tree.next_shots)]
+    while stack:
+        path, node = stack.pop()
+        yield path, node
+        if max_depth is not None and len(path) >= max_depth:
+            continue
+        for shot in reversed(node.next_shots):
+            stack.append((path + (shot.shot,), shot))
+
+def find_path(tree, path: tuple):
+    """
+        Node at the end of path, None if the tree does not have it
+    """
+    node = tree
+    for shot in path:
+        for next_shot in node.next_shots:
+            if next_shot.shot == shot:
+                node = next_shot
+                break
+        else:
+            return None
+    return node
+
+def top_k(node, k: int) -> list:
+    return [shot.shot for shot in sorted(node.next_shots, key=lambda x: x.num_hit, reverse=True)[:k]]
+
+def top_k_divergence(full_tree, sample_tree, k: int=5, min_hit: int=1, max_depth=None) -> dict:
+    """
+        How far the order of the top k next shots of the sample tree is from the full tree
+        Only nodes of the full tree hit at least min_hit times that have next shots are compared
+        Returns a dict with:
+            nodes       : number of nodes compared
+            missing     : nodes the sample tree does not have at all
+            top_1       : fraction of nodes where the most hit next shot is the same
+            overlap     : average fraction of the top k next shots both trees have
+            same_order  : fraction of nodes where the top k next shots are exactly the same, in the same order
+    """
+    nodes = missing = top_1 = same_order = 0
+    overlap = 0.0
+    comparisons = [((), full_tree)]
+    comparisons.extend(walk_paths(full_tree, max_depth))
+    for path, full_node in comparisons:
+        if not full_node.next_shots or (path and full_node.num_hit < min_hit):
+            continue
+        nodes += 1
+        sample_node = find_path(sample_tree, path)
+        if sample_node is None or not sample_node.next_shots:
+            missing += 1
+            continue
+        full_top = top_k(full_node, k)
+        sample_top = top_k(sample_node, k)
+        top_1 += full_top[0] == sample_top[0]
+        overlap += len(set(full_top) & set(sample_top)) / len(full_top)
+        same_order += full_top == sample_top
+    if nodes == 0:
+        return {"nodes": 0, "missing": 0, "top_1": 0.0, "overlap": 0.0, "same_order": 0.0}
+    return {
+        "nodes": nodes,
+        "missing": missing,
+        "top_1": top_1 / nodes,
+        "overlap": overlap / nodes,
+        "same_order": same_order / nodes,
+    }
+
+def interval_coverage(full_tree, sample_tree, min_hit: int=1, max_depth=None, z: float=Z_95) -> dict:
+    """
+        Fraction of the nodes of the sample tree (hit at least min_hit times) whose
+        full tree probability is inside the sample's confidence interval, per probability
+    """
+    covered = {stat: 0 for stat in PROBABILITY_STATS}
+    nodes = 0
+    for path, sample_node in walk_paths(sample_tree, max_depth):
+        if sample_node.num_hit < min_hit:
+            continue
+        full_node = find_path(full_tree, path)
+        if full_node is None:
+            continue
+        nodes += 1
+        intervals = probability_intervals(sample_node, z)
+        for stat in PROBABILITY_STATS:
+            low, high = intervals[stat]
+            covered[stat] += low <= full_node.get_stat(stat) <= high
+    return {stat: covered[stat] / nodes if nodes else 0.0 for stat in PROBABILITY_STATS}
+
+def usage(return_val):
+    print("""
+Sampled Tree Builder:
+    USAGE: python3 sampling.py [FLAGS] [OPTIONS]
+    -f FILE             : raw data file
+    -r FRACTION         : fraction of the points used to build the tree
+    -m METHOD           : how the points are sampled (match, uniform)
+    -seed SEED          : seed of the sample
+    -k K                : number of next shots compared with the full tree
+    -depth DEPTH        : only report nodes up to DEPTH shots deep
+    -min MIN_HIT        : only report nodes the tree hit at least MIN_HIT times
+    -full               : also build the full tree and compare the sample with it
+    -e ENCODING         : encoding of the raw file
+    -j WORKERS          : read the file with this many worker processes
+    -h                  : print out this message
+
+    DEFAULTS:
+    FILE                = data/raw/charting-m-points-2010s.csv
+    FRACTION            = 0.1
+    METHOD              = match
+    SEED                = 0
+    K                   = 5
+    DEPTH               = 2
+    MIN_HIT             = 30
+    ENCODING            = windows-1252
+    WORKERS             = 1
+
+    Prints the 95% confidence interval of every reported node's probabilities,
+    with -full also how often those intervals contain the full tree's value and
+    how much the top K next shots differ from the full tree
+    """)
+    sys.exit(return_val)
+
+def main():
+    raw_path = "data/raw/charting-m-points-2010s.csv"
+    fraction = 0.1
+    method = "match"
+    seed = 0
+    k = 5
+    max_depth = 2
+    min_hit = 30
+    compare = False
+    encoding = "windows-1252"
+    workers = 1
+    arguments = sys.argv[1:]
+    try:
+        while arguments:
+            current_arg = arguments.pop(0)
+            if current_arg == '-h':
+                usage(0)
+            elif current_arg == '-f':
+                raw_path = arguments.pop(0)
+            elif current_arg == '-r':
+                fraction = float(arguments.pop(0))
+            elif current_arg == '-m':
+                method = arguments.pop(0)
+            elif current_arg == '-seed':
+                seed = int(arguments.pop(0))
+            elif current_arg == '-k':
+                k = int(arguments.pop(0))
+            elif current_arg == '-depth':
+                max_depth = int(arguments.pop(0))
+            elif current_arg == '-min':
+                min_hit = int(arguments.pop(0))
+            elif current_arg == '-full':
+                compare = True
+            elif current_arg == '-e':
+                encoding = arguments.pop(0)
+            elif current_arg == '-j':
+                workers = int(arguments.pop(0))
+            else:
+                usage(1)
+    except Exception:
+        usage(1)
+    if method not in SAMPLE_METHODS or not 0 < fraction <= 1:
+        usage(1)
+
+    start = time.perf_counter()
+    sample_tree = sort_data(sample_point_data(raw_path, fraction, seed, method, encoding, workers))
+    sample_time = time.perf_counter() - start
+    print(f"sampled tree ({fraction:g} of the points, {method}): {sample_tree.count_nodes()} nodes in {sample_time:.2f}s")
+    print("path\tnumber of times hit\tcontinue_prob [95% ci]\twinner_prob [95% ci]\terror_prob [95% ci]")
+    for path, node in walk_paths(sample_tree, max_depth):
+        if node.num_hit < min_hit:
+            continue
+        intervals = probability_intervals(node)
+        print(" ".join(path) + f"\t{node.num_hit}\t" + "\t".join(
+            f"{node.get_stat(stat):.3f} [{intervals[stat][0]:.3f}, {intervals[stat][1]:.3f}]" for stat in PROBABILITY_STATS))
+
+    if compare:
+        start = time.perf_counter()
+        full_tree = sort_data(get_point_data(raw_path, encoding=encoding, workers=workers))
+        full_time = time.perf_counter() - start
+        print(f"\nfull tree: {full_tree.count_nodes()} nodes in {full_time:.2f}s ({full_time / sample_time:.1f}x the sample)")
+        coverage = interval_coverage(full_tree, sample_tree, min_hit, max_depth)
+        print("full tree value inside the 95% ci: " + ", ".join(f"{stat} {coverage[stat]:.1%}" for stat in PROBABILITY_STATS))
+        divergence = top_k_divergence(full_tree, sample_tree, k, min_hit, max_depth)
+        print(f"top {k} next shots over {divergence['nodes']} nodes: same most hit shot {divergence['top_1']:.1%}, "
+              f"overlap {divergence['overlap']:.1%}, same order {divergence['same_order']:.1%}, "
+              f"missing from the sample {divergence['missing']}")
+
+if __name__ == "__main__":
+    main()
@@ -14,12 +14,13 @@
         
 """
 from tree import Shot
-from random import randint
+from random import randint, Random
 
 MIN_REQUIRED_SHOTS = 5 # the cutoff for items in the tree, if there are fewer than this many of that shot, it will be ignored
 RESTRICTED_SEARCH = False
 MAX_OPTIONS = 5
 RAND_VAL_RESOLUTION = 1000
+CONTEXT_INDEX = None # set with use_context_index
 
 def max_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
     """
@@ -27,7 +28,7 @@ def max_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
     
     """
     if len(shot.next_shots) < MIN_REQUIRED_SHOTS:
-        shot = breadth_first_search(shot.shot, head)
+        shot = find_equivalent(shot, head, MIN_REQUIRED_SHOTS)
         if shot == head:
             if verbose:
                 print("The BFS failed to find a shot of that type")
@@ -36,6 +37,8 @@ def max_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
             if verbose:
                 print("The BFS has found an equivalent node")
 
+    if shot.columns is not None:
+        return shot.next_shots[shot.columns.argmax(stat)]
     next_shot = shot.next_shots[0]
     max = next_shot.get_stat(stat)
     for next in shot.next_shots:
@@ -49,7 +52,7 @@ def min_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
         Minimize the desired stat
     """
     if len(shot.next_shots) < MIN_REQUIRED_SHOTS:
-        shot = breadth_first_search(shot.shot, head)
+        shot = find_equivalent(shot, head, MIN_REQUIRED_SHOTS)
         if shot == head:
             if verbose:
                 print("The BFS failed to find a shot of that type")
@@ -58,6 +61,8 @@ def min_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
             if verbose:
                 print("The BFS has found an equivalent node")
 
+    if shot.columns is not None:
+        return shot.next_shots[shot.columns.argmin(stat)]
     next_shot = shot.next_shots[0]
     min = next_shot.get_stat(stat)
     for next in shot.next_shots:
@@ -75,7 +80,7 @@ def max_opponent_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
         Looking for the shot with the highest minimum
     """
     if not shot.next_shots or not shot.next_shots[0].next_shots:
-        shot = breadth_first_search(shot.shot, head)
+        shot = find_equivalent(shot, head)
         if shot == head:
             if verbose:
                 print("The BFS failed to find a shot of that type")
@@ -99,7 +104,7 @@ def min_opponent_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
         Looking for the shot with the lowest maximum
     """
     if not shot.next_shots or not shot.next_shots[0].next_shots:
-        shot = breadth_first_search(shot.shot, head)
+        shot = find_equivalent(shot, head)
         if shot == head:
             if verbose:
                 print("The BFS failed to find a shot of that type")
@@ -116,6 +121,43 @@ def min_opponent_stat(stat: str, shot: Shot, head: Shot, verbose=False) -> Shot:
             our_choice = our_option
     return our_choice
 
+def shown_options(shot: Shot) -> list:
+    """
+        The next shots that are shown to a human player:
+        the first MAX_OPTIONS in next_shots order, only shots hit more than
+        MIN_REQUIRED_SHOTS times when RESTRICTED_SEARCH is on
+    """
+    min_hit = MIN_REQUIRED_SHOTS if RESTRICTED_SEARCH else None
+    options = []
+    for next_shot in shot.next_shots:
+        if len(options) >= MAX_OPTIONS:
+            break
+        if min_hit is None or next_shot.num_hit > min_hit:
+            options.append(next_shot)
+    return options
+
+def use_context_index(context_index):
+    """
+        Make the algorithms back off to the context index (see context_index.py)
+        instead of searching the tree when a node does not have enough data
+        None goes back to using the breadth first search
+    """
+    global CONTEXT_INDEX
+    CONTEXT_INDEX = context_index
+
+def find_equivalent(shot: Shot, head: Shot, min_options: int=1) -> Shot:
+    """
+        Find a node with more data for the same situation as shot
+
+        Uses the context index if one is in use and it has a context with
+        enough support, otherwise searches the tree for the same shot
+    """
+    if CONTEXT_INDEX is not None:
+        equivalent = CONTEXT_INDEX.lookup(shot, min_options)
+        if equivalent is not None:
+            return equivalent
+    return breadth_first_search(shot.shot, head)
+
 def breadth_first_search(shot:str, tree: Shot, verbose=True) -> Shot:
     """
         Search the tree for a node that is this shot
@@ -157,7 +199,7 @@ def human_vs_human(search_tree: Shot, max_score: int=10, verbose=False):
         while not point_finished: # point
             print("Player ", 1 if next > 0 else 2, "'s turn:", sep="")
             if len(current_shot.next_shots) < MIN_REQUIRED_SHOTS:
-                current_shot = breadth_first_search(current_shot.shot, search_tree)
+                current_shot = find_equivalent(current_shot, search_tree, MIN_REQUIRED_SHOTS)
                 if current_shot == search_tree:
                     if verbose:
                         print("The BFS failed to find a shot of that type")
@@ -165,13 +207,8 @@ def human_vs_human(search_tree: Shot, max_score: int=10, verbose=False):
                     if verbose:
                         print("The BFS has found an equivalent node")
             print("Options:")
-            num_shown = 0
-            for shot in current_shot.next_shots:
-                if num_shown >= MAX_OPTIONS:
-                    break
-                if shot.num_hit > MIN_REQUIRED_SHOTS or not RESTRICTED_SEARCH:
-                    print(f'{shot.shot}\tnumber of times hit: {shot.num_hit: 10.2f} | chance the point continues:{shot.continue_prob: 6.2f} | chance of winner:{shot.winner_prob: 6.2f} | chance of mistake:{shot.error_prob: 6.2f}')
-                    num_shown+=1
+            for shot in shown_options(current_shot):
+                print(f'{shot.shot}\tnumber of times hit: {shot.num_hit: 10.2f} | chance the point continues:{shot.continue_prob: 6.2f} | chance of winner:{shot.winner_prob: 6.2f} | chance of mistake:{shot.error_prob: 6.2f}')
             choice = input("Please choose a shot from the list of shots: ")
             try:
                 shot_index = [s.shot for s in current_shot.next_shots].index(choice)
@@ -258,7 +295,7 @@ def human_vs_alg(search_tree: Shot, algorithm, stat: str="continue_prob", max_sc
             if next == 1: # human picks shot
                 print("Player ", 1 if next > 0 else 2, "'s turn:", sep="")
                 if len(current_shot.next_shots) < MIN_REQUIRED_SHOTS:
-                    current_shot = breadth_first_search(current_shot.shot, search_tree)
+                    current_shot = find_equivalent(current_shot, search_tree, MIN_REQUIRED_SHOTS)
                     if current_shot == search_tree:
                         if verbose:
                             print("The BFS failed to find a shot of that type")
@@ -266,13 +303,8 @@ def human_vs_alg(search_tree: Shot, algorithm, stat: str="continue_prob", max_sc
                         if verbose:
                             print("The BFS has found an equivalent node")
                 print("Options:")
-                num_shown = 0
-                for shot in current_shot.next_shots:
-                    if num_shown >= MAX_OPTIONS:
-                        break
-                    if shot.num_hit > MIN_REQUIRED_SHOTS or not RESTRICTED_SEARCH:
-                        print(f'{shot.shot}\tnumber of times hit: {shot.num_hit: 10.2f} | chance the point continues:{shot.continue_prob: 6.2f} | chance of winner:{shot.winner_prob: 6.2f} | chance of mistake:{shot.error_prob: 6.2f}\n\ttheir next shots: {", ".join([s.shot for s in shot.next_shots])}')
-                        num_shown+=1
+                for shot in shown_options(current_shot):
+                    print(f'{shot.shot}\tnumber of times hit: {shot.num_hit: 10.2f} | chance the point continues:{shot.continue_prob: 6.2f} | chance of winner:{shot.winner_prob: 6.2f} | chance of mistake:{shot.error_prob: 6.2f}\n\ttheir next shots: {", ".join([s.shot for s in shot.next_shots])}')
                 choice = input("Please choose a shot from the list of shots: ")
                 try:
                     shot_index = [s.shot for s in current_shot.next_shots].index(choice)
@@ -329,17 +361,27 @@ def human_vs_alg(search_tree: Shot, algorithm, stat: str="continue_prob", max_sc
         print("Player 2 wins!")
 
 # TODO: write alg-vs-alg function
-def alg_vs_alg(search_tree: Shot, algorithms: list, stat: list[str, str]=["continue_prob", "continue_prob"], max_score: int=10, verbose=False):
+def alg_vs_alg(search_tree: Shot, algorithms: list, stat: list[str, str]=["continue_prob", "continue_prob"], max_score: int=10, verbose=False, seed=None, log=None) -> tuple:
     """
         TODO: rework how algorithms are passed to this function
 
         Same rules as human_vs_human and human_vs_alg
+
+        Passing a seed makes the match reproducible
+        Passing a MatchLog (see match_log.py) writes every shot and point to it,
+        a seed is picked when none is given so the match can be replayed
+        Returns the final score
     """
+    if log is not None and seed is None:
+        seed = Random().getrandbits(64)
+    randint = Random(seed).randint # seed=None seeds from the system like the random module does
     side = 1 # 1 is deuce, -1 is ad
     score = (0, 0) # tuple containing the score of the players
                    # NOTE: in "real" tennis, the score is structured in points, games, and sets
                    #       however, to simplify, I am going to use 10-point tie-break scoring
     server = 1 if randint(0, 1) == 0 else -1 # 1 is p1, -1 is p2, randomized who starts serving
+    if log is not None:
+        log.start_match(seed, [f"{algorithm.__name__}:{s}" for algorithm, s in zip(algorithms, stat)], max_score, server)
 
     while score[0] < max_score and score[1] < max_score:
         p1_score, p2_score = score
@@ -357,12 +399,14 @@ def alg_vs_alg(search_tree: Shot, algorithms: list, stat: list[str, str]=["conti
                 print("player", 1 if next > 0 else 2, "hit:", f'{current_shot.shot}\tnumber of times hit: {current_shot.num_hit: 10.2f} | chance the point continues:{current_shot.continue_prob: 6.2f} | chance of winner:{current_shot.winner_prob: 6.2f} | chance of mistake:{current_shot.error_prob: 6.2f}')
             
             # now check if the shot succeeded
+            outcome = 0 # continue, 1 is a winner, 2 is a mistake (same as match_log)
             chance_of_making_the_shot = randint(0, RAND_VAL_RESOLUTION) / RAND_VAL_RESOLUTION
             if chance_of_making_the_shot > current_shot.error_prob:
                 # yay you made the shot, now check if it was a winner
                 chance_of_winner = randint(0, RAND_VAL_RESOLUTION) / RAND_VAL_RESOLUTION
                 if chance_of_winner < current_shot.winner_prob:
                     # yay you hit a winner
+                    outcome = 1
                     point_finished = True
                     if next == 1:
                         p1_score += 1
@@ -371,15 +415,20 @@ def alg_vs_alg(search_tree: Shot, algorithms: list, stat: list[str, str]=["conti
                 # if you did not hit a winner and did not miss it, then the point just continues
             else:
                 # oh no, you missed it
+                outcome = 2
                 point_finished = True
                 if next == 1:
                     p2_score += 1
                 else:
                     p1_score += 1
+            if log is not None:
+                log.shot(current_shot, 0 if next > 0 else 1, outcome)
             
             next *= -1
             
 
+        if log is not None:
+            log.point(0 if p1_score > score[0] else 1, (p1_score, p2_score))
         score = (p1_score, p2_score)
         side *= -1 # switch sides
         if p1_score + p2_score == 1:
@@ -392,4 +441,7 @@ def alg_vs_alg(search_tree: Shot, algorithms: list, stat: list[str, str]=["conti
     if score[0] > score[1]:
         print("Player 1 wins!")
     else:
-        print("Player 2 wins!")
\ No newline at end of file
+        print("Player 2 wins!")
+    if log is not None:
+        log.end_match(score)
+    return score
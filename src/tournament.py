@@ -0,0 +1,318 @@
+"""
+Round-robin tournament between every algorithm/stat combination
+
+Every strategy (algorithm + stat) plays every strategy (including itself)
+with alg_vs_alg. Pairings are spread over a process pool that shares one
+tree, every match gets its own seed so the whole tournament is reproducible,
+and finished pairings are appended to a checkpoint file so an interrupted
+tournament can be resumed. Pairings of a strategy against itself are played
+but left out of the win rates.
+
+"""
+import os
+import io
+import sys
+import functools
+import contextlib
+import multiprocessing
+from random import Random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tennis_algorithm import alg_vs_alg
+from tennis_algorithm import min_stat, max_stat, max_opponent_stat, min_opponent_stat
+from tree import sort_data, finalize_tree, STATS
+from parse_raw_data import get_point_data
+from build_trees import build_trees, is_multi_file, find_raw_files, select_raw_files, source_stamp
+from match_log import MatchLog
+from confidence import wilson_interval
+
+ALGORITHMS = {
+    "max_stat": max_stat,
+    "min_stat": min_stat,
+    "max_opponent_stat": max_opponent_stat,
+    "min_opponent_stat": min_opponent_stat,
+}
+STRATEGIES = [f"{algorithm}:{stat}" for algorithm in ALGORITHMS for stat in STATS]
+CHECKPOINT_HEADER = "player_1\tplayer_2\tmatches\tplayer_1_wins\tplayer_2_wins\tplayer_1_errors\tplayer_2_errors\n"
+
+TREE = None # tree shared with the worker processes
+
+def usage(return_val):
+    print("""
+Strategy Tournament:
+    USAGE: python3 tournament.py [FLAGS] [OPTIONS]
+    -m MATCHES          : number of matches played by each pairing
+    -s SCORE            : the score that the players are trying to reach
+    -j WORKERS          : number of worker processes
+    -seed SEED          : seed the match seeds are derived from
+    -c FILE             : checkpoint file, finished pairings in it are not played again
+                          (the checkpoint has to be from the same MATCHES, SCORE, SEED and tree)
+    -o FILE             : where the results table is written
+    -tree PATH          : path to the file (or directory/glob) used to build the tree
+    -e ENCODING         : encoding used on data file
+    -n NUM_NODES        : the maximum number of next_shots any node can have
+    -log DIRECTORY      : write the matches of every pairing to a match log in DIRECTORY
+                          (read them with match_log.py)
+    -h                  : print out this message
+
+    DEFAULTS:
+    MATCHES             = 10
+    SCORE               = 10
+    WORKERS             = number of cpus
+    SEED                = 0
+    FILE (-c)           = data/tournament/checkpoint.tsv
+    FILE (-o)           = data/tournament/results.tsv
+    PATH                = data/raw/charting-m-points-2010s.csv
+    ENCODING            = windows-1252
+    NUM_NODES           = 6
+    """)
+    sys.exit(return_val)
+
+def match_seed(seed, player_1: str, player_2: str, match: int) -> int:
+    """
+        Seed of a single match, only depends on the pairing and the match number
+        so it does not matter which worker plays it or in what order
+    """
+    return Random(f"{seed}:{player_1}:{player_2}:{match}").getrandbits(64)
+
+def log_path(log_dir: str, player_1: str, player_2: str) -> str:
+    return os.path.join(log_dir, f"{player_1}_vs_{player_2}.log".replace(":", "-"))
+
+def watch_moves(algorithm, player: int, crashed: list):
+    """
+        The algorithm, but when one of its moves raises the player (0 or 1) is appended to crashed
+        Keeps the name of the algorithm so the match log still names the strategy
+    """
+    @functools.wraps(algorithm)
+    def move(*args):
+        try:
+            return algorithm(*args)
+        except Exception:
+            crashed.append(player)
+            raise
+    return move
+
+def play_pairing(player_1: str, player_2: str, matches: int, max_score: int, seed, log_dir=None, tree_arguments=None) -> tuple:
+    """
+        Play all matches of one pairing on the shared tree
+        Runs inside a worker process
+        With a log_dir the finished matches are written to a match log,
+        tree_arguments are the main.py flags that build the same tree (so the log can be verified)
+
+        Returns (player_1, player_2, matches, player_1 wins, player_2 wins, player_1 errors, player_2 errors)
+        a match that crashes is counted as an error of the player whose move raised
+        instead of a win or loss (a crash outside of both algorithms is nobody's error)
+    """
+    algorithm_1, stat_1 = player_1.split(":")
+    algorithm_2, stat_2 = player_2.split(":")
+    crashed = []
+    algorithms = [watch_moves(ALGORITHMS[algorithm_1], 0, crashed), watch_moves(ALGORITHMS[algorithm_2], 1, crashed)]
+    wins = [0, 0]
+    errors = [0, 0]
+    log = MatchLog(log_path(log_dir, player_1, player_2), tree_arguments) if log_dir is not None else None
+    for match in range(matches):
+        crashed.clear()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                score = alg_vs_alg(TREE, algorithms, [stat_1, stat_2], max_score, seed=match_seed(seed, player_1, player_2, match), log=log)
+        except Exception:
+            if crashed:
+                errors[crashed[-1]] += 1
+            if log is not None:
+                log.abort_match()
+            continue
+        wins[0 if score[0] > score[1] else 1] += 1
+    if log is not None:
+        log.close()
+    return player_1, player_2, matches, wins[0], wins[1], errors[0], errors[1]
+
+def tournament_settings(matches: int, max_score: int, seed) -> str:
+    return f"matches={matches} max_score={max_score} seed={seed}"
+
+def tree_source(tree_path: str, encoding: str, max_nodes: int) -> str:
+    """
+        String that changes whenever the files the tree is built from or the way it is built change
+    """
+    if is_multi_file(tree_path):
+        sources = ";".join(source_stamp(f) for f in select_raw_files(find_raw_files(tree_path)))
+    else:
+        sources = source_stamp(tree_path)
+    return f"{sources} encoding={encoding} max_nodes={max_nodes}"
+
+def read_checkpoint(path: str) -> tuple:
+    """
+        Settings and finished pairings from the checkpoint file
+        Returns (metadata, results)
+            metadata: dict[str, str] from the "# key<TAB>value" lines at the top of the file
+            results : (player_1, player_2) -> (matches, player_1 wins, player_2 wins, player_1 errors, player_2 errors)
+    """
+    metadata = {}
+    results = {}
+    if not os.path.exists(path):
+        return metadata, results
+    with open(path, 'r', encoding='utf8') as checkpoint:
+        for line in checkpoint:
+            if line.startswith("# "):
+                key, _, value = line[2:].rstrip("\n").partition("\t")
+                metadata[key] = value
+                continue
+            if line == CHECKPOINT_HEADER:
+                continue
+            if line.startswith("player_1\t"):
+                raise ValueError(f"{path} was written by an older version of the tournament, remove it to start over")
+            player_1, player_2, matches, wins_1, wins_2, errors_1, errors_2 = line.rstrip("\n").split("\t")
+            results[(player_1, player_2)] = (int(matches), int(wins_1), int(wins_2), int(errors_1), int(errors_2))
+    return metadata, results
+
+def results_table(results: dict) -> list:
+    """
+        Win rate of every strategy over all of its matches (as player 1 and as player 2)
+        Rows are (strategy, matches, wins, errors, win rate, ci low, ci high), best first
+        matches only counts finished matches, errors are the matches that crashed on one of the strategy's moves,
+        a strategy with many errors is ranked on the matches it happened to finish
+        Pairings of a strategy against itself are not counted (one win every two matches)
+    """
+    played = {strategy: 0 for strategy in STRATEGIES}
+    won = {strategy: 0 for strategy in STRATEGIES}
+    crashed = {strategy: 0 for strategy in STRATEGIES}
+    for (player_1, player_2), (matches, wins_1, wins_2, errors_1, errors_2) in results.items():
+        if player_1 == player_2:
+            continue
+        crashed[player_1] += errors_1
+        crashed[player_2] += errors_2
+        played[player_1] += wins_1 + wins_2
+        played[player_2] += wins_1 + wins_2
+        won[player_1] += wins_1
+        won[player_2] += wins_2
+    rows = []
+    for strategy in STRATEGIES:
+        low, high = wilson_interval(won[strategy], played[strategy])
+        rate = won[strategy] / played[strategy] if played[strategy] else 0.0
+        rows.append((strategy, played[strategy], won[strategy], crashed[strategy], rate, low, high))
+    rows.sort(key=lambda row: row[4], reverse=True)
+    return rows
+
+def write_results(rows: list, path: str):
+    with open(path, 'w', encoding='utf8') as output:
+        output.write("strategy\tmatches\twins\terrors\twin_rate\tci_low\tci_high\n")
+        for strategy, matches, wins, errors, rate, low, high in rows:
+            output.write(f"{strategy}\t{matches}\t{wins}\t{errors}\t{rate:.4f}\t{low:.4f}\t{high:.4f}\n")
+
+def run_tournament(tree, matches: int=10, max_score: int=10, workers=None, seed=0, checkpoint_path: str="data/tournament/checkpoint.tsv", verbose=True, log_dir=None, source: str="", tree_arguments=None) -> dict:
+    """
+        Play every pairing that is not in the checkpoint yet
+        source describes the tree (see tree_source), a checkpoint written with other settings
+        or for another tree raises a ValueError instead of being mixed into the results
+        Returns the results of all pairings (including the ones from the checkpoint)
+    """
+    global TREE
+    TREE = tree
+    settings = tournament_settings(matches, max_score, seed)
+    metadata, results = read_checkpoint(checkpoint_path)
+    if os.path.exists(checkpoint_path) and (metadata.get("settings") != settings or metadata.get("tree") != source):
+        raise ValueError(
+            f"{checkpoint_path} was written with other settings or another tree\n"
+            f"    checkpoint: {metadata.get('settings')} tree={metadata.get('tree')}\n"
+            f"    now:        {settings} tree={source}\n"
+            "use another checkpoint file (-c) or remove it to start over")
+    pairings = [(p1, p2) for p1 in STRATEGIES for p2 in STRATEGIES if (p1, p2) not in results]
+    if verbose:
+        print(len(results), "pairings loaded from", checkpoint_path + ",", len(pairings), "left to play")
+    if not pairings:
+        return results
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    new_file = not os.path.exists(checkpoint_path)
+    # fork so every worker shares the tree that was built here
+    context = multiprocessing.get_context("fork")
+    with open(checkpoint_path, 'a', encoding='utf8') as checkpoint, \
+         ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        if new_file:
+            checkpoint.write(f"# settings\t{settings}\n")
+            checkpoint.write(f"# tree\t{source}\n")
+            checkpoint.write(CHECKPOINT_HEADER)
+        jobs = [executor.submit(play_pairing, p1, p2, matches, max_score, seed, log_dir, tree_arguments) for p1, p2 in pairings]
+        for finished, job in enumerate(as_completed(jobs), start=1):
+            player_1, player_2, num_matches, wins_1, wins_2, errors_1, errors_2 = job.result()
+            results[(player_1, player_2)] = (num_matches, wins_1, wins_2, errors_1, errors_2)
+            checkpoint.write(f"{player_1}\t{player_2}\t{num_matches}\t{wins_1}\t{wins_2}\t{errors_1}\t{errors_2}\n")
+            checkpoint.flush()
+            if verbose:
+                print(f"[{finished}/{len(pairings)}] {player_1} vs {player_2}: {wins_1}-{wins_2}"
+                      + (f" (errors {errors_1}-{errors_2})" if errors_1 or errors_2 else ""))
+    return results
+
+def main():
+    """
+        Build the tree once and run the tournament on it
+    """
+    matches = 10
+    max_score = 10
+    workers = None
+    seed = 0
+    checkpoint_path = "data/tournament/checkpoint.tsv"
+    output_path = "data/tournament/results.tsv"
+    tree_path = "data/raw/charting-m-points-2010s.csv"
+    encoding = "windows-1252"
+    max_nodes = 6
+    log_dir = None
+    arguments = sys.argv[1:]
+    try:
+        while arguments:
+            current_arg = arguments.pop(0)
+            if current_arg == '-h':
+                usage(0)
+            elif current_arg == '-m':
+                matches = int(arguments.pop(0))
+            elif current_arg == '-s':
+                max_score = int(arguments.pop(0))
+            elif current_arg == '-j':
+                workers = int(arguments.pop(0))
+            elif current_arg == '-seed':
+                seed = arguments.pop(0)
+            elif current_arg == '-c':
+                checkpoint_path = arguments.pop(0)
+            elif current_arg == '-o':
+                output_path = arguments.pop(0)
+            elif current_arg == '-tree':
+                tree_path = arguments.pop(0)
+            elif current_arg == '-e':
+                encoding = arguments.pop(0)
+            elif current_arg == '-n':
+                max_nodes = int(arguments.pop(0))
+            elif current_arg == '-log':
+                log_dir = arguments.pop(0)
+            else:
+                usage(1)
+    except Exception:
+        usage(1)
+
+    print("building search tree from", tree_path)
+    if is_multi_file(tree_path):
+        tree = build_trees(tree_path, encoding=encoding)
+        if tree is None:
+            sys.exit(1)
+    else:
+        tree = sort_data(get_point_data(tree_path, encoding=encoding))
+    tree.clean_tree(max_nodes)
+    finalize_tree(tree)
+    print("done")
+
+    try:
+        results = run_tournament(
+            tree, matches, max_score, workers, seed, checkpoint_path,
+            log_dir=log_dir, source=tree_source(tree_path, encoding, max_nodes),
+            tree_arguments=["-tree", tree_path, "-e", encoding, "-n", str(max_nodes)])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    rows = results_table(results)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    write_results(rows, output_path)
+    print("strategy\t\t\tmatches\terrors\twin rate\t95% ci")
+    for strategy, num_matches, wins, errors, rate, low, high in rows:
+        print(f"{strategy:<32}{num_matches}\t{errors}\t{rate:.3f}\t\t[{low:.3f}, {high:.3f}]")
+    print("results written to", output_path)
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,10 @@ ADDITIONAL FEATURES:
 
 """
 import sys
+from array import array
+
+TREE_FILE_VERSION = "1"
+STATS = ("num_hit", "num_success", "continue_prob", "winner_prob", "error_prob")
 
 class Shot:
     """
@@ -29,6 +33,8 @@ class Shot:
         self.continue_prob = 0
         self.winner_prob = 0
         self.error_prob = 0
+        self.other = None
+        self.columns = None
     
     def usage(return_val):
         print("""
@@ -44,6 +50,11 @@ Shot class:
     continue_prob   : float         = value from 0-1 describing likelyhood of point continuing after this shot
     winner_prob     : float         = value from 0-1 describing likelyhood of this shot being a winner
     error_prob      : float         = value from 0-1 describing likelyhood of this shot being an error
+    other           : Shot          = bucket holding the combined counts of next shots that were pruned
+                                      from the tree, None if nothing has been pruned
+    columns         : ChildColumns  = stats of the next shots stored by column, set by finalize_tree
+                                      None if the node has not been finalized or has been
+                                      modified since (every method that changes next_shots resets it)
 
         """)
         sys.exit(return_val)
@@ -94,8 +105,11 @@ Shot class:
                   sorting functions
         """
         self.num_hit += shot.num_hit
-        for shot in shot.next_shots:
-            self.add_next_shot(shot)
+        self.columns = None
+        for next_shot in shot.next_shots:
+            self.add_next_shot(next_shot)
+        if shot.other is not None:
+            self.fold_into_other(shot.other)
         for outcome in shot.outcomes:
             try:
                 self.outcomes[outcome] += shot.outcomes[outcome]
@@ -109,7 +123,17 @@ Shot class:
         if sort:
             self.next_shots.sort(key=lambda x: x.num_hit, reverse=True)
         
-        # update probabilities
+        self.update_probabilities(rally_continues)
+        
+        num_outcomes = sum(self.outcomes[s] for s in self.outcomes)
+        assert self.num_hit == num_outcomes, "number of times hit does not equal the total number of outcomes seen"
+        prob_sum = round(self.continue_prob + self.winner_prob + self.error_prob, 5)
+        assert prob_sum == 1, "percentages do not equal the correct value"
+        return self
+    def update_probabilities(self, rally_continues: list=["7", "8", "9", "continue"]):
+        """
+            Recalculate num_success and the probabilities from the outcomes dict
+        """
         self.num_success = 0
         try:
             continue_sum = 0
@@ -137,17 +161,12 @@ Shot class:
             self.error_prob = error_sum / self.num_hit
         except Exception:
             self.error_prob = 0
-        
-        num_outcomes = sum(self.outcomes[s] for s in self.outcomes)
-        assert self.num_hit == num_outcomes, "number of times hit does not equal the total number of outcomes seen"
-        prob_sum = round(self.continue_prob + self.winner_prob + self.error_prob, 5)
-        assert prob_sum == 1, "percentages do not equal the correct value"
-        return self
+
     def add_next_shot(self, next_shot, sort=True, require_direction=True):
         """
             Add a next_shot
         """
-
+        self.columns = None
         next_shot_indexes = [s.shot for s in self.next_shots]
         if next_shot.shot in next_shot_indexes:
             index = next_shot_indexes.index(next_shot.shot)
@@ -156,35 +175,93 @@ Shot class:
             self.next_shots.append(next_shot)
         
     
-    def add_point(self, shots: list, ignored_points="SRPQ0;"):
+    def add_point(self, shots: list, ignored_points="SRPQ0;", max_depth=None, profiles=None, players=None, index=0) -> int:
         """
             Parameter: list describing a point
 
             Adds that point to the tree
+            Shots deeper than max_depth are dropped (None means no limit)
+            With a ProfileStore (see player.py) every shot is also counted for the player
+            that hit it, players is (server, returner) and index the position of shots[0] in the rally
+
+            Returns the number of new nodes that were created
 
             TODO: ignore shots that do not include direction (i.e. 'b' instead of 'b3')
         
         """
         if not shots:
-            return
+            return 0
+        if max_depth is not None:
+            if max_depth <= 0:
+                if profiles is not None:
+                    # the tree stops here, the profiles still count the rest of the rally
+                    profiles.add_point(shots, players, ignored_points, index)
+                return 0
+            max_depth -= 1
         raw_next = shots.pop(0).replace(" ", "") # remove spaces
         #raw_next = raw_next.replace("c", "") # remove lets
         if not raw_next:
-            return
+            return 0
         next_shot = Shot.from_str(raw_next)
         if any(s in ignored_points for s in next_shot.shot):
-            return
+            return 0
+        if profiles is not None:
+            profiles.add_shot(next_shot, players[index % 2])
+        self.columns = None
         try:
             # the next shot is already one of the next shots
-            index = [s.shot for s in self.next_shots].index(next_shot.shot)
-            #print("shot", next_shot, "found at index", index)
-            new_shot = self.next_shots[index].update(next_shot)
-            new_shot.add_point(shots)
+            position = [s.shot for s in self.next_shots].index(next_shot.shot)
+            #print("shot", next_shot, "found at index", position)
+            new_shot = self.next_shots[position].update(next_shot)
+            return new_shot.add_point(shots, ignored_points, max_depth, profiles, players, index + 1)
         except ValueError:
             # the next shot is new, it has not been seen here before
             #print("shot", next_shot, "has not been seen before")
             self.next_shots.append(next_shot)
-            next_shot.add_point(shots)
+            return 1 + next_shot.add_point(shots, ignored_points, max_depth, profiles, players, index + 1)
+
+    def count_nodes(self) -> int:
+        """
+            Number of nodes in this subtree, including this node
+            (other buckets are not counted)
+        """
+        return 1 + sum(shot.count_nodes() for shot in self.next_shots)
+
+    def fold_into_other(self, shot):
+        """
+            Move the counts of a next shot into the other bucket
+            The subtree below the shot is thrown away
+        """
+        if self.other is None:
+            self.other = Shot("other", 0, 0, [], {})
+        self.other.num_hit += shot.num_hit
+        for outcome in shot.outcomes:
+            try:
+                self.other.outcomes[outcome] += shot.outcomes[outcome]
+            except Exception:
+                self.other.outcomes[outcome] = shot.outcomes[outcome]
+        self.other.update_probabilities()
+
+    def prune_tree(self, min_support: int) -> int:
+        """
+            Evict every subtree whose shot was hit fewer than min_support times
+            Evicted shots are folded into the other bucket of their parent so
+            the hit counts of a node's children still add up
+
+            Returns the number of nodes that were removed
+        """
+        removed = 0
+        kept = []
+        self.columns = None
+        for shot in self.next_shots:
+            if shot.num_hit < min_support:
+                removed += shot.count_nodes()
+                self.fold_into_other(shot)
+            else:
+                removed += shot.prune_tree(min_support)
+                kept.append(shot)
+        self.next_shots = kept
+        return removed
 
     def clean_tree(self, max_keep=10, clean_dead=[]):
         """
@@ -193,6 +270,7 @@ Shot class:
             TODO: make this method usable
         """
         # assumption: tree is sorted
+        self.columns = None
         self.next_shots = self.next_shots[:max_keep]
         indexes_to_remove = set()
         for index, shot in enumerate(self.next_shots):
@@ -209,6 +287,138 @@ Shot class:
 
 
 
+class ChildColumns:
+    """
+        The stats of a node's next shots, one array per stat
+        Index i of every column belongs to next_shots[i]
+
+        Picking the best next shot becomes a couple of builtin calls on an
+        array instead of a python loop that goes through get_stat
+    """
+    def __init__(self, next_shots):
+        self.columns = {stat: array('d', [shot.get_stat(stat) for shot in next_shots]) for stat in STATS}
+
+    def column(self, stat: str) -> array:
+        try:
+            return self.columns[stat]
+        except KeyError:
+            Shot.usage(1)
+
+    def argmax(self, stat: str) -> int:
+        """
+            Index of the first next shot with the highest stat
+        """
+        column = self.column(stat)
+        return column.index(max(column))
+
+    def argmin(self, stat: str) -> int:
+        """
+            Index of the first next shot with the lowest stat
+        """
+        column = self.column(stat)
+        return column.index(min(column))
+
+def finalize_tree(tree: Shot):
+    """
+        Build the ChildColumns of every node that has next shots
+
+        Has to be called again if the tree is modified afterwards
+        (modified nodes drop their columns and fall back to the python loops),
+        compacted trees get their columns from compact_tree
+    """
+    seen = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen or isinstance(node, SharedShot):
+            continue
+        seen.add(id(node))
+        if node.next_shots:
+            node.columns = ChildColumns(node.next_shots)
+            stack.extend(node.next_shots)
+
+class SharedShot(Shot):
+    """
+        Node of a compacted tree (see compact_tree)
+
+        The same SharedShot can be the next shot of several different nodes,
+        so it can not be modified after it has been created
+        next_shots is a tuple instead of a list
+    """
+    def __setattr__(self, name, value):
+        raise AttributeError(f"shared node '{self.shot}' can not be modified")
+
+    @classmethod
+    def from_shot(cls, shot: Shot, next_shots: tuple, other=None):
+        """
+            Copy a node, using the given (already shared) next shots
+            The columns are built here since the node can not be finalized later
+        """
+        node = object.__new__(cls)
+        for key in shot.__dict__:
+            object.__setattr__(node, key, shot.__dict__[key])
+        object.__setattr__(node, "next_shots", next_shots)
+        object.__setattr__(node, "other", other)
+        object.__setattr__(node, "columns", ChildColumns(next_shots) if next_shots else None)
+        return node
+
+def compact_tree(tree: Shot) -> Shot:
+    """
+        Canonicalize structurally identical subtrees into one shared node
+
+        Two subtrees are identical if the shot, counts, outcomes, probabilities
+        and (shared) next shots all match. The result is a DAG made of
+        SharedShot nodes that can be used anywhere a tree can be read,
+        anything that modifies the tree (clean_tree, update, add_point, ...)
+        has to be done before compacting it.
+    """
+    canonical = {}
+    shared = {} # id of the original node -> shared node
+    stack = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in shared:
+            continue
+        if not children_done:
+            stack.append((node, True))
+            for shot in node.next_shots:
+                stack.append((shot, False))
+            if node.other is not None:
+                stack.append((node.other, False))
+            continue
+        next_shots = tuple(shared[id(shot)] for shot in node.next_shots)
+        other = shared[id(node.other)] if node.other is not None else None
+        key = (
+            node.shot, node.num_hit, node.num_success,
+            node.continue_prob, node.winner_prob, node.error_prob,
+            tuple(sorted(node.outcomes.items())),
+            tuple(id(shot) for shot in next_shots),
+            id(other))
+        if key not in canonical:
+            canonical[key] = SharedShot.from_shot(node, next_shots, other)
+        shared[id(node)] = canonical[key]
+    return shared[id(tree)]
+
+def tree_size(tree: Shot) -> tuple:
+    """
+        Returns (number of distinct nodes, approximate number of bytes used by them)
+        Shared nodes are only counted once
+    """
+    seen = set()
+    num_bytes = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        num_bytes += sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+        num_bytes += sys.getsizeof(node.next_shots) + sys.getsizeof(node.outcomes)
+        stack.extend(node.next_shots)
+        if node.other is not None:
+            stack.append(node.other)
+    return len(seen), num_bytes
+
 def parse_individual_point(raw_point: str, possible_shots="fbrsvzopuylmhijktq") -> list:
     """
         Parses point sentences into a list of individual shots
@@ -231,14 +441,28 @@ def parse_individual_point(raw_point: str, possible_shots="fbrsvzopuylmhijktq")
         shots.insert(0, current_shot)
     return shots
 
-def sort_data(raw_data, valid_starts="456") -> Shot:
+def sort_data(raw_data, valid_starts="456", max_nodes=None, max_depth=None, profiles=None) -> Shot:
     """
         Shot tree starts with a placeholder "start" node
         Each possible serve is contained in head.next_shots
         from there the rally is stored in the tree as expected
+
+        max_nodes   : node budget for the tree, when the tree grows past it the
+                      least supported subtrees are evicted while building
+                      (lossy counting: the support threshold starts at 2 and
+                      doubles until the tree is back under 3/4 of the budget,
+                      it never goes back down)
+        max_depth   : shots deeper than this in a rally are not added to the tree
+        profiles    : ProfileStore (see player.py) that collects the shots of each player
+                      while the tree is built, raw_data then has to be (point, (server, returner))
+                      pairs like get_point_data(..., players=True) returns
     """
     tree_head = Shot("Start", 1, 1, [])
+    num_nodes = 1
+    min_support = 2
     for point in raw_data:
+        if profiles is not None:
+            point, players = point
         individual_points = parse_individual_point(point)
         if not individual_points:
             continue
@@ -246,5 +470,142 @@ def sort_data(raw_data, valid_starts="456") -> Shot:
                                                                  # start with a serve
                                                                  # done primarily to avoid incorrect
                                                                  # optimizations in minmax algorithms
-            tree_head.add_point(individual_points)
-    return tree_head
\ No newline at end of file
+            if profiles is not None:
+                num_nodes += tree_head.add_point(individual_points, max_depth=max_depth, profiles=profiles, players=players)
+            else:
+                num_nodes += tree_head.add_point(individual_points, max_depth=max_depth)
+        if max_nodes is not None and num_nodes > max_nodes:
+            num_nodes -= tree_head.prune_tree(min_support)
+            while num_nodes > max_nodes * 3 // 4 and tree_head.next_shots:
+                min_support *= 2
+                num_nodes -= tree_head.prune_tree(min_support)
+    return tree_head
+
+
+def merge_trees(trees: list) -> Shot:
+    """
+        Combine several shot trees into one tree
+
+        The nodes of the given trees are reused (and updated) by the merged tree,
+        so the given trees should not be used afterwards
+    """
+    tree_head = Shot("Start", 1, 1, [])
+    for tree in trees:
+        for shot in tree.next_shots:
+            tree_head.add_next_shot(shot)
+        if tree.other is not None:
+            tree_head.fold_into_other(tree.other)
+    tree_head.next_shots.sort(key=lambda x: x.num_hit, reverse=True)
+    return tree_head
+
+def save_tree(tree: Shot, path: str, metadata: dict={}):
+    """
+        Write the tree to a file, one node per line
+
+        File format:
+            lines starting with '#' hold metadata as "# key<TAB>value"
+            every other line is a node written in depth-first (pre)order:
+                depth  kind  shot  num_hit  num_success  continue_prob  winner_prob  error_prob  outcomes
+            kind is 'n' for a normal node and 'o' for the other bucket of the
+            closest node above it, outcomes are written as "outcome=count,outcome=count"
+            files with the metadata "# order<TAB>post" list every node after its
+            next shots instead (see external_build.py)
+    """
+    with open(path, 'w', encoding='utf8') as tree_file:
+        tree_file.write(f"# version\t{TREE_FILE_VERSION}\n")
+        for key in metadata:
+            tree_file.write(f"# {key}\t{metadata[key]}\n")
+        stack = [(tree, 0, 'n')]
+        while stack:
+            node, depth, kind = stack.pop()
+            tree_file.write(node_to_line(node, depth, kind))
+            if kind == 'o':
+                continue
+            for shot in reversed(node.next_shots):
+                stack.append((shot, depth + 1, 'n'))
+            if node.other is not None:
+                stack.append((node.other, depth + 1, 'o'))
+
+def node_to_line(node: Shot, depth: int, kind: str='n') -> str:
+    """
+        Format a single node as a line of the tree file
+    """
+    outcomes = ",".join(f"{key}={node.outcomes[key]}" for key in node.outcomes)
+    return f"{depth}\t{kind}\t{node.shot}\t{node.num_hit}\t{node.num_success}\t{node.continue_prob!r}\t{node.winner_prob!r}\t{node.error_prob!r}\t{outcomes}\n"
+
+def node_from_line(line: str) -> tuple:
+    """
+        Parse a line of the tree file
+        returns (depth, kind, node)
+    """
+    depth, kind, shot, num_hit, num_success, continue_prob, winner_prob, error_prob, raw_outcomes = line.rstrip("\n").split("\t")
+    outcomes = {}
+    if raw_outcomes:
+        for item in raw_outcomes.split(","):
+            key, count = item.split("=")
+            outcomes[key] = int(count)
+    node = Shot(shot, int(num_hit), int(num_success), [], outcomes)
+    node.continue_prob = float(continue_prob)
+    node.winner_prob = float(winner_prob)
+    node.error_prob = float(error_prob)
+    return int(depth), kind, node
+
+def read_tree_metadata(path: str) -> dict:
+    """
+        Read just the metadata at the top of a tree file
+    """
+    metadata = {}
+    with open(path, 'r', encoding='utf8') as tree_file:
+        for line in tree_file:
+            if not line.startswith("#"):
+                break
+            key, value = line[2:].rstrip("\n").split("\t", 1)
+            metadata[key] = value
+    return metadata
+
+def load_tree(path: str) -> Shot:
+    """
+        Read a tree written by save_tree (or in postorder by external_build.py)
+    """
+    if read_tree_metadata(path).get("order") == "post":
+        return load_postorder_tree(path)
+    stack = []
+    with open(path, 'r', encoding='utf8') as tree_file:
+        for line in tree_file:
+            if line.startswith("#"):
+                continue
+            depth, kind, node = node_from_line(line)
+            if depth == 0:
+                stack = [node]
+                continue
+            del stack[depth:]
+            if kind == 'o':
+                stack[depth - 1].other = node
+            else:
+                stack[depth - 1].next_shots.append(node)
+                stack.append(node)
+    return stack[0]
+
+def load_postorder_tree(path: str) -> Shot:
+    """
+        Read a tree file that lists every node after its next shots
+        Next shots are sorted so the most hit ones come first
+    """
+    pending = {} # depth -> nodes waiting for the node above them
+    tree_head = None
+    with open(path, 'r', encoding='utf8') as tree_file:
+        for line in tree_file:
+            if line.startswith("#"):
+                continue
+            depth, kind, node = node_from_line(line)
+            for child_kind, child in pending.pop(depth + 1, []):
+                if child_kind == 'o':
+                    node.other = child
+                else:
+                    node.next_shots.append(child)
+            node.next_shots.sort(key=lambda x: x.num_hit, reverse=True)
+            if depth == 0:
+                tree_head = node
+            else:
+                pending.setdefault(depth, []).append((kind, node))
+    return tree_head